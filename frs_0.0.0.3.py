@@ -3,76 +3,3336 @@ Sistema de Control de Acceso con Reconocimiento Facial para Gimnasio
 """
 import os
 import csv
+import json
+import math
+import argparse
+import bisect
+import contextlib
+import copy
+import re
+import hashlib
+import importlib
+import io
 import sqlite3
+import time
+import threading
+import queue
+import itertools
+import statistics
+import asyncio
+import signal
+import urllib.parse
+import multiprocessing
+import platform
+import shutil
+import subprocess
+import tempfile
+import zipfile
 import numpy as np
-from datetime import datetime
-from PIL import Image, ImageTk
-import cv2 as cv
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import date, datetime
 import tkinter as tk
 from tkinter import ttk, messagebox
+try:
+    import resource  # Solo Unix: memoria máxima del proceso en el banco de pruebas
+except ImportError:
+    resource = None
+
+# Constantes
+DB_PATH = 'members.db'
+SAMPLES_DIR = 'face_samples'
+MODEL_PATH = 'face_model.yml'
+MODEL_META_PATH = 'face_model.json'
+NUMPY_MODEL_PATH = 'face_model.npy'  # Histogramas del reconocedor NumPy (se abren con mmap)
+# 'numpy', 'opencv' (cv.face de opencv-contrib) o 'auto'. Por defecto NumPy aunque cv.face esté instalado:
+# la verificación usa el mismo buscador con ambos y el .npy se guarda y abre mucho antes que el .yml
+# (ver "backends" en `bench`)
+RECOGNIZER_BACKEND = 'numpy'
+ACCESS_LOG_PATH = 'acceso_gimnasio.csv'
+ACCESS_LOG_HEADER = ["Fecha", "Hora", "ID Membresía", "Nombre", "Resultado",
+                     "Confianza", "Latencia (ms)"]
+ACCESS_LOG_MAX_BYTES = 5 * 1024 * 1024  # Rotar también al superar este tamaño (0 = solo diario)
+ACCESS_LOG_FLUSH_SECONDS = 1.0  # Espera para agrupar eventos en una sola escritura
+ACCESS_LOG_SQLITE = False  # Copiar los eventos a la tabla access_log de la BD
+SERVER_HOST = '127.0.0.1'  # El servicio de verificación solo escucha localmente por defecto
+SERVER_PORT = 8765
+SERVER_MAX_UPLOAD = 8 * 1024 * 1024  # Tamaño máximo de imagen aceptado
+MODEL_RELOAD_SECONDS = 30  # Cada cuánto el servicio comprueba si cambiaron las muestras
+MEMBER_SYNC_SECONDS = 1  # Cada cuánto se comprueba si otro proceso cambió la tabla de miembros
+CAMERA_SOURCE = '0'  # Fuente de video de las ventanas de captura (índice, archivo o URL)
+MULTICAM_MAX_INFLIGHT = 2  # Rostros por cámara pendientes en el grupo de reconocimiento
+MULTICAM_FOLDER_FPS = 15  # Velocidad simulada de una carpeta de imágenes
+MULTICAM_REPORT_SECONDS = 5  # Intervalo del informe por cámara
+BENCH_MEMBERS = (100, 1000)  # Tamaños de la base de miembros que mide el banco de pruebas
+BENCH_QUERIES = 200  # Predicciones medidas por tamaño
+BENCH_FRAMES = 300  # Fotogramas del video usados para medir la detección
+BENCH_NATIVE_QUERIES = 25  # Predicciones sin preselección por implementación (son lentas con muchos miembros)
+SAMPLE_EXTS = ('.npy', '.png', '.jpg', '.jpeg')
+SAMPLES_PER_MEMBER = 5  # Muestras capturadas en ráfaga al registrar o recapturar
+BURST_INTERVAL = 3  # Fotogramas entre muestras de una ráfaga
+FACE_SIZE = (200, 200)  # Tamaño canónico de los rostros normalizados
+USE_CLAHE = True  # CLAHE en lugar de ecualización global del histograma
+ALIGN_EYES = False  # Alinear los ojos antes de normalizar (más lento)
+PREPROCESS_VERSION = 1  # Cambiarlo invalida muestras y modelo guardados
+SAMPLE_STORE_PATH = 'face_store.json'  # Índice del almacén empaquetado (datos en face_store.N.bin)
+SAMPLE_STORE_MAX_GARBAGE = 0.5  # Fracción de filas obsoletas que provoca reescribir el almacén
+MATCHER_EXACT_BELOW = 128  # Con menos muestras se compara contra todas (medido: así no es más lento)
+MATCHER_PROJECTION_DIMS = 256  # Componentes principales de los histogramas usadas para preseleccionar
+MATCHER_SHORTLIST = 64  # Candidatos que se comparan con chi-cuadrado exacto
+MATCHER_CHUNK_ROWS = 512  # Filas por bloque al recorrer la matriz de histogramas
+MATCHER_TAIL_CAPACITY = 64  # Filas reservadas para las altas que se añaden sin reentrenar
+LBPH_BATCH = 64  # Rostros por bloque al extraer histogramas en lote
+TRAIN_WORKERS = None  # Procesos para extraer histogramas al reentrenar (None = uno por núcleo)
+TRAIN_CHUNK = 256  # Muestras por tarea del entrenamiento en paralelo
+TRAIN_PARALLEL_MIN = 1000  # Con menos muestras se entrena sin crear procesos
+ENROLL_MAX_SIDE = 1280  # Lado máximo de una foto de alta masiva antes de detectar el rostro
+ENROLL_CHUNK = 16  # Miembros por tarea al detectar rostros en paralelo
+ENROLL_PARALLEL_MIN = 50  # Con menos miembros con foto se detecta sin crear procesos
+PHOTO_EXTS = ('.jpg', '.jpeg', '.png', '.bmp')
+ARCHIVE_FORMAT = 1  # Versión del .zip de export-archive
+COMPACTION_DELAY = 60  # Segundos de espera para agrupar altas antes de compactar
+DETECT_SCALE = 0.5  # Escala del fotograma sobre la que corre la cascada
+FULL_DETECT_INTERVAL = 15  # Fotogramas máximos entre detecciones de imagen completa
+TRACK_MARGIN = 0.5  # Margen de búsqueda alrededor del último rostro (fracción de su tamaño)
+GUIDE_SEARCH_HALF = 200  # Mitad del lado de la ventana de búsqueda alrededor de la guía
+MAX_SKIP_FRAMES = 3  # Fotogramas sin detectar como máximo con el rostro quieto
+STABLE_SHIFT = 4  # Desplazamiento (px) por debajo del cual el rostro se considera quieto
+CONFIDENCE_THRESHOLD = 70  # Distancia LBPH máxima aceptada (menor es mejor; 50-80 es común)
+VOTE_WINDOW = 7  # Predicciones máximas que se agregan para una decisión
+VOTE_MIN = 3  # Predicciones mínimas antes de decidir por mayoría
+VOTE_MARGIN = 3  # Ventaja de votos sobre la segunda opción para decidir antes de tiempo
+VOTE_STRONG_CONFIDENCE = 35  # Distancia tan baja que una sola predicción basta
+LIVENESS_ENABLED = False  # Exigir una prueba de vida (activar tras calibrar los umbrales con la cámara real)
+LIVENESS_MIN_FRAMES = 4  # Fotogramas mínimos antes de dar por vivo un rostro
+LIVENESS_MAX_SECONDS = 4.0  # Sin indicios de vida en este tiempo se repite el intento (no cuenta como suplantación)
+LIVENESS_MOTION_LIVE = 0.6  # Deformación (px en 64x64, percentil 95) que ningún movimiento afín explica
+LIVENESS_GRADIENT_KEEP = 0.5  # Fracción de píxeles con más gradiente que entran en el residuo (el flujo en zonas lisas es ruido)
+LIVENESS_BOX_SMOOTHING = 0.1  # Peso de cada detección en el centro suavizado del recorte
+LIVENESS_BLINK_RISE = 0.04  # Subida relativa del brillo de la franja de los ojos al cerrarlos
+LIVENESS_MOIRE_RATIO = 40.0  # Pico/mediana del espectro de alta frecuencia que delata el muaré de una pantalla
+LIVENESS_COST_SMOOTHING = 0.2  # Peso de cada medida en el coste medio de cada comprobación
+KIOSK_STABLE_FRAMES = 3  # Detecciones centradas seguidas antes de reconocer en modo kiosko
+KIOSK_DEBOUNCE_SECONDS = 10  # Tiempo durante el que se ignora al mismo miembro ya reconocido
+KIOSK_RESULT_SECONDS = 3  # Tiempo que el resultado permanece en pantalla
+METRICS_ENABLED = False  # Cronometrar cada etapa de la verificación (también con --metrics)
+METRICS_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)  # Límites (s)
+METRICS_DUMP_PATH = 'metrics.json'  # Resumen JSON que la interfaz reescribe periódicamente
+METRICS_DUMP_SECONDS = 30  # Intervalo entre volcados del resumen
+METRICS_SMOOTHING = 0.1  # Peso de cada medida en la media móvil mostrada en pantalla
+SHOW_STATS_OVERLAY = False  # Mostrar FPS y latencias sobre el video (también con --overlay)
+EXPIRING_DAYS = 7  # Horizonte de los avisos y de la lista de próximos vencimientos
+SKIP_EXPIRED_MEMBERS = False  # Excluir del buscador a los vencidos (un vencido parecido a otro miembro podría pasar por él)
+MEMBER_PAGE_SIZE = 100  # Miembros que el buscador carga por página
+MEMBER_SEARCH_DELAY = 150  # Milisegundos sin teclear antes de lanzar la búsqueda
+DARK_BG = "#1E1E1E"
+LIGHT_BG = "#2D2D30"
+ACCENT_COLOR = "#0078D7"
+TEXT_COLOR = "#FFFFFF"
+
+# Módulos pesados: se importan en el primer uso para que la ventana aparezca enseguida
+class LazyModule:
+    """Importa un módulo en el primer acceso a uno de sus atributos"""
+    def __init__(self, name, alias):
+        self._name = name
+        self._alias = alias
+        self._module = None
+        self._lock = threading.Lock()
+    
+    def _load(self):
+        """Importa el módulo y lo deja en lugar de este objeto entre las globales"""
+        with self._lock:
+            if self._module is None:
+                self._module = importlib.import_module(self._name)
+                globals()[self._alias] = self._module
+        return self._module
+    
+    def __getattr__(self, attr):
+        return getattr(self._module or self._load(), attr)
+
+cv = LazyModule('cv2', 'cv')
+Image = LazyModule('PIL.Image', 'Image')
+ImageTk = LazyModule('PIL.ImageTk', 'ImageTk')
+
+# Inicialización del detector facial
+FACE_CASCADE_FILE = 'haarcascade_frontalface_default.xml'
+EYE_CASCADE_FILE = 'haarcascade_eye.xml'
+_cascades = threading.local()
+_cascade_pool = queue.SimpleQueue()  # Detectores ya cargados (y calentados) libres para otro hilo
+
+def cascade_path(filename):
+    """Ruta de una cascada Haar incluida en OpenCV (o en el directorio actual)"""
+    try:
+        return cv.data.haarcascades + filename
+    except AttributeError:
+        return filename
+
+def get_face_cascade():
+    """Devuelve el detector del hilo actual (CascadeClassifier no es seguro entre hilos)"""
+    cascade = getattr(_cascades, "face", None)
+    if cascade is None:
+        try:
+            cascade = _cascade_pool.get_nowait()
+        except queue.Empty:
+            cascade = cv.CascadeClassifier(cascade_path(FACE_CASCADE_FILE))
+        _cascades.face = cascade
+    return cascade
+
+def release_face_cascade():
+    """Devuelve el detector del hilo actual al grupo para que otro hilo no tenga que cargarlo"""
+    cascade = getattr(_cascades, "face", None)
+    if cascade is not None:
+        _cascades.face = None
+        _cascade_pool.put(cascade)
+
+def get_eye_cascade():
+    """Devuelve el detector de ojos del hilo actual"""
+    cascade = getattr(_cascades, "eye", None)
+    if cascade is None:
+        cascade = _cascades.eye = cv.CascadeClassifier(cascade_path(EYE_CASCADE_FILE))
+    return cascade
+
+def chi_square_distances(histograms, sums, query, indices=None):
+    """Distancia chi-cuadrado alternativa (la de LBPH) de una consulta a varias filas"""
+    # Donde la consulta es 0 cada término vale la fila: se resuelve con la suma precalculada
+    nonzero = np.flatnonzero(query)
+    if indices is not None:
+        histograms = histograms[indices]
+        sums = sums[indices]
+    rows = np.take(histograms, nonzero, axis=1).astype(np.float64)
+    q = np.asarray(query, dtype=np.float64)[nonzero]
+    rest = sums - rows.sum(axis=1)
+    # Operaciones en sitio: el coste lo domina el tráfico de memoria
+    diff = rows - q
+    diff *= diff
+    rows += q
+    diff /= rows
+    return 2.0 * (rest + diff.sum(axis=1))
+
+class NumpyLBPH:
+    """Reconocedor LBPH en NumPy con la interfaz de cv.face.LBPHFaceRecognizer"""
+    def __init__(self, radius=1, neighbors=8, grid_x=8, grid_y=8, threshold=float('inf')):
+        self.radius = radius
+        self.neighbors = neighbors
+        self.grid_x = grid_x
+        self.grid_y = grid_y
+        self.threshold = threshold
+        self.dims = grid_x * grid_y * (1 << neighbors)
+        self.histograms = np.empty((0, self.dims), dtype=np.float32)
+        self.labels = np.empty(0, dtype=np.int32)
+        self.sums = np.empty(0, dtype=np.float64)
+        
+        # Vecinos interpolados en float32 igual que elbp() de opencv-contrib
+        self.taps = []
+        for n in range(neighbors):
+            x = np.float32(radius * math.cos(2.0 * math.pi * n / neighbors))
+            y = np.float32(-radius * math.sin(2.0 * math.pi * n / neighbors))
+            fx, fy = int(math.floor(x)), int(math.floor(y))
+            cx, cy = int(math.ceil(x)), int(math.ceil(y))
+            tx, ty = x - np.float32(fx), y - np.float32(fy)
+            one = np.float32(1)
+            weights = ((one - tx) * (one - ty), tx * (one - ty), (one - tx) * ty, tx * ty)
+            self.taps.append(((fy, fx), (fy, cx), (cy, fx), (cy, cx), weights))
+    
+    def getRadius(self):
+        return self.radius
+    
+    def getNeighbors(self):
+        return self.neighbors
+    
+    def getGridX(self):
+        return self.grid_x
+    
+    def getGridY(self):
+        return self.grid_y
+    
+    def getHistograms(self):
+        return self.histograms
+    
+    def getLabels(self):
+        return self.labels.reshape(-1, 1)
+    
+    def _lbp(self, images):
+        """Códigos LBP extendidos de un lote (B, alto, ancho)"""
+        r = self.radius
+        _, h, w = images.shape
+        src = images.astype(np.float32)
+        center = src[:, r:h - r, r:w - r]
+        codes = np.zeros(center.shape, dtype=np.int32)
+        for n, (p1, p2, p3, p4, (w1, w2, w3, w4)) in enumerate(self.taps):
+            t = (w1 * src[:, r + p1[0]:h - r + p1[0], r + p1[1]:w - r + p1[1]] +
+                 w2 * src[:, r + p2[0]:h - r + p2[0], r + p2[1]:w - r + p2[1]] +
+                 w3 * src[:, r + p3[0]:h - r + p3[0], r + p3[1]:w - r + p3[1]] +
+                 w4 * src[:, r + p4[0]:h - r + p4[0], r + p4[1]:w - r + p4[1]])
+            hit = (t > center) | (np.abs(t - center) < np.finfo(np.float32).eps)
+            codes |= hit.astype(np.int32) << n
+        return codes
+    
+    def _spatial_histograms(self, codes):
+        """Histogramas normalizados por celda de la rejilla, concatenados por rostro"""
+        count, h, w = codes.shape
+        cell_h, cell_w = h // self.grid_y, w // self.grid_x
+        bins = 1 << self.neighbors
+        cells = codes[:, :cell_h * self.grid_y, :cell_w * self.grid_x]
+        cells = cells.reshape(count, self.grid_y, cell_h, self.grid_x, cell_w)
+        cells = cells.transpose(0, 1, 3, 2, 4).reshape(count, -1, cell_h * cell_w)
+        # Un solo bincount para todas las celdas del lote desplazando cada una su rango
+        offsets = np.arange(cells.shape[0] * cells.shape[1]).reshape(count, -1, 1) * bins
+        hist = np.bincount((cells + offsets).ravel(), minlength=offsets.size * bins)
+        return hist.reshape(count, self.dims).astype(np.float32) * np.float32(1.0 / (cell_h * cell_w))
+    
+    def compute_histograms(self, faces):
+        """Histogramas LBP espaciales de varios rostros, procesados en lotes del mismo tamaño"""
+        out = np.empty((len(faces), self.dims), dtype=np.float32)
+        start = 0
+        for _, group in itertools.groupby(faces, key=lambda face: face.shape):
+            group = list(group)
+            for offset in range(0, len(group), LBPH_BATCH):
+                batch = np.stack(group[offset:offset + LBPH_BATCH])
+                out[start:start + len(batch)] = self._spatial_histograms(self._lbp(batch))
+                start += len(batch)
+        return out
+    
+    def train(self, faces, labels):
+        self.histograms = np.empty((0, self.dims), dtype=np.float32)
+        self.labels = np.empty(0, dtype=np.int32)
+        self.sums = np.empty(0, dtype=np.float64)
+        self.update(faces, labels)
+    
+    def set_histograms(self, histograms, labels):
+        """Reemplaza el modelo por histogramas ya calculados (entrenamiento en paralelo)"""
+        self.histograms = np.asarray(histograms, dtype=np.float32)
+        self.labels = np.asarray(labels, dtype=np.int32).ravel()
+        self.sums = self.histograms.sum(axis=1, dtype=np.float64)
+    
+    def update(self, faces, labels):
+        histograms = self.compute_histograms(list(faces))
+        self.histograms = np.vstack([self.histograms, histograms])
+        self.labels = np.concatenate([self.labels, np.asarray(labels, dtype=np.int32).ravel()])
+        self.sums = np.concatenate([self.sums, histograms.sum(axis=1, dtype=np.float64)])
+    
+    def distance_matrix(self, queries):
+        """Distancias chi-cuadrado (consultas x muestras) en una sola pasada por los histogramas"""
+        out = np.empty((len(queries), len(self.labels)), dtype=np.float64)
+        for start in range(0, len(self.labels), MATCHER_CHUNK_ROWS):
+            # Cada bloque se lee una vez (importa con mmap) y se compara con todas las consultas
+            block = np.asarray(self.histograms[start:start + MATCHER_CHUNK_ROWS])
+            sums = self.sums[start:start + MATCHER_CHUNK_ROWS]
+            for i, query in enumerate(queries):
+                out[i, start:start + len(block)] = chi_square_distances(block, sums, query)
+        return out
+    
+    def predict_batch(self, faces):
+        """Predice varios rostros a la vez; devuelve (etiquetas, distancias)"""
+        distances = self.distance_matrix(self.compute_histograms(list(faces)))
+        best = distances.argmin(axis=1)
+        scores = distances[np.arange(len(best)), best]
+        labels = np.where(scores < self.threshold, self.labels[best], -1)
+        return labels, scores
+    
+    def predict(self, face):
+        query = self.compute_histograms([face])[0]
+        best_label, best_distance = -1, float('inf')
+        for start in range(0, len(self.labels), MATCHER_CHUNK_ROWS):
+            distances = chi_square_distances(
+                self.histograms[start:start + MATCHER_CHUNK_ROWS],
+                self.sums[start:start + MATCHER_CHUNK_ROWS], query
+            )
+            i = int(np.argmin(distances))
+            if distances[i] < best_distance:
+                best_label, best_distance = int(self.labels[start + i]), float(distances[i])
+        if best_distance >= self.threshold:
+            best_label = -1
+        return best_label, best_distance
+    
+    def write(self, path):
+        """Guarda etiquetas e histogramas en un .npy estructurado que se puede abrir con mmap"""
+        dtype = np.dtype([('label', '<i4'), ('hist', '<f4', (self.dims,))])
+        data = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(len(self.labels),))
+        for start in range(0, len(self.labels), MATCHER_CHUNK_ROWS):
+            stop = start + MATCHER_CHUNK_ROWS
+            data['label'][start:stop] = self.labels[start:stop]
+            data['hist'][start:stop] = self.histograms[start:stop]
+        data.flush()
+        del data
+    
+    def read(self, path):
+        """Abre los histogramas guardados sin copiarlos a memoria"""
+        # En Windows un archivo mapeado no se puede reemplazar al guardar un modelo nuevo
+        data = np.load(path, mmap_mode=None if os.name == 'nt' else 'r')
+        if data.dtype.names != ('label', 'hist') or data.dtype['hist'].shape != (self.dims,):
+            raise ValueError(f"{path} no corresponde a este reconocedor")
+        self.histograms = data['hist']
+        self.labels = np.array(data['label'])
+        self.sums = np.concatenate([
+            self.histograms[start:start + MATCHER_CHUNK_ROWS].sum(axis=1, dtype=np.float64)
+            for start in range(0, len(self.labels), MATCHER_CHUNK_ROWS)
+        ]) if len(self.labels) else np.empty(0, dtype=np.float64)
+
+def recognizer_backend():
+    """Implementación de LBPH en uso"""
+    if RECOGNIZER_BACKEND == 'auto':
+        return 'opencv' if hasattr(cv, 'face') else 'numpy'
+    return RECOGNIZER_BACKEND
+
+def create_recognizer():
+    """Crea un reconocedor LBPH vacío de la implementación configurada"""
+    if recognizer_backend() == 'numpy':
+        return NumpyLBPH()
+    return cv.face.LBPHFaceRecognizer_create()
+
+def model_path():
+    """Archivo del modelo persistido según la implementación"""
+    return NUMPY_MODEL_PATH if recognizer_backend() == 'numpy' else MODEL_PATH
+
+# Métricas de rendimiento por etapa
+class StageSpan:
+    """Cronometra un bloque y suma su duración al histograma de la etapa"""
+    __slots__ = ('metrics', 'stage', 'started')
+    
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        self.metrics.observe(self.stage, time.perf_counter() - self.started)
+        return False
+
+class StageMetrics:
+    """Histogramas de duración de cada etapa (lectura, detección, predicción, registro...)"""
+    # Contexto compartido que no mide nada: desactivadas, las métricas no crean objetos
+    DISABLED = contextlib.nullcontext()
+    
+    def __init__(self, enabled=METRICS_ENABLED, buckets=METRICS_BUCKETS):
+        self.enabled = enabled
+        self.overlay = SHOW_STATS_OVERLAY
+        self.buckets = tuple(buckets)
+        self.stages = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.dump_thread = None
+    
+    def span(self, stage):
+        """Contexto que cronometra una etapa si las métricas están activadas"""
+        if not self.enabled:
+            return self.DISABLED
+        return StageSpan(self, stage)
+    
+    def observe(self, stage, seconds):
+        """Suma una duración en segundos al histograma de la etapa"""
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            entry = self.stages.get(stage)
+            if entry is None:
+                entry = self.stages[stage] = {
+                    "counts": [0] * (len(self.buckets) + 1), "count": 0, "sum": 0.0, "recent": seconds
+                }
+            entry["counts"][index] += 1
+            entry["count"] += 1
+            entry["sum"] += seconds
+            entry["recent"] += METRICS_SMOOTHING * (seconds - entry["recent"])
+    
+    def recent_ms(self, stage):
+        """Media móvil reciente de una etapa en milisegundos (None si aún no se midió)"""
+        entry = self.stages.get(stage)
+        return None if entry is None else entry["recent"] * 1000
+    
+    def _copy(self):
+        """Copia coherente de los contadores para exponerlos sin retener el cerrojo"""
+        with self.lock:
+            return {stage: dict(entry, counts=list(entry["counts"]))
+                    for stage, entry in sorted(self.stages.items())}
+    
+    def _quantile_ms(self, entry, q):
+        """Cota superior del cuantil según los límites del histograma"""
+        rank = q * entry["count"]
+        cumulative = 0
+        for bound, count in zip(self.buckets, entry["counts"]):
+            cumulative += count
+            if cumulative >= rank:
+                return bound * 1000
+        return None  # Por encima del último límite
+    
+    def snapshot(self):
+        """Resumen serializable en JSON: recuento, media y cuantiles por etapa"""
+        stages = {}
+        for stage, entry in self._copy().items():
+            stages[stage] = {
+                "count": entry["count"],
+                "mean_ms": round(entry["sum"] * 1000 / entry["count"], 3),
+                "p50_ms": self._quantile_ms(entry, 0.5),
+                "p95_ms": self._quantile_ms(entry, 0.95),
+                "p99_ms": self._quantile_ms(entry, 0.99),
+                "buckets": dict(zip([f"{bound:g}" for bound in self.buckets] + ["+Inf"],
+                                    itertools.accumulate(entry["counts"]))),
+            }
+        return {
+            "timestamp": datetime.now().isoformat(timespec='seconds'),
+            "uptime_s": round(time.time() - self.started, 1),
+            "stages": stages,
+        }
+    
+    def prometheus(self):
+        """Histogramas en el formato de texto de Prometheus"""
+        lines = [
+            "# HELP gymaccess_stage_seconds Duración de cada etapa de la verificación",
+            "# TYPE gymaccess_stage_seconds histogram",
+        ]
+        for stage, entry in self._copy().items():
+            bounds = [f"{bound:g}" for bound in self.buckets] + ["+Inf"]
+            for bound, cumulative in zip(bounds, itertools.accumulate(entry["counts"])):
+                lines.append(f'gymaccess_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'gymaccess_stage_seconds_sum{{stage="{stage}"}} {entry["sum"]:.6f}')
+            lines.append(f'gymaccess_stage_seconds_count{{stage="{stage}"}} {entry["count"]}')
+        return "\n".join(lines) + "\n"
+    
+    def dump(self, path=METRICS_DUMP_PATH):
+        """Escribe el resumen JSON reemplazando el archivo de forma atómica"""
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(self.snapshot(), file, indent=2)
+        os.replace(temp_path, path)
+    
+    def start_dump(self, path=METRICS_DUMP_PATH, interval=METRICS_DUMP_SECONDS):
+        """Vuelca el resumen periódicamente desde un hilo de fondo"""
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.dump(path)
+                except OSError as e:
+                    print(f"Error al guardar las métricas: {e}")
+        
+        if self.dump_thread is None:
+            self.dump_thread = threading.Thread(target=loop, daemon=True)
+            self.dump_thread.start()
+
+metrics = StageMetrics()
+
+# Funciones de preparación
+def ensure_dirs():
+    """Crea directorios necesarios"""
+    if not os.path.exists(SAMPLES_DIR):
+        os.makedirs(SAMPLES_DIR)
+
+def day_number(exp_str):
+    """Número de día (date.toordinal) de una fecha YYYY-MM-DD, como members.expiration_day"""
+    return datetime.strptime(exp_str, "%Y-%m-%d").date().toordinal()
+
+class MemberRepository:
+    """Acceso a miembros con una conexión persistente y caché en memoria"""
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self.conn = None
+        self.lock = threading.RLock()
+        self._members = None  # membership_id -> (nombre, fecha de expiración)
+        self._labels = None   # membership_id -> etiqueta permanente
+        self.fts = False      # Búsqueda de texto completo (FTS5) disponible
+        self._access = None   # (día de hoy, bitmap etiqueta -> membresía vigente); se reemplaza entero
+        self._data_version = None  # PRAGMA data_version al cargar la caché
+        self._synced = 0.0
+    
+    def connect(self):
+        """Abre la conexión (una sola para toda la aplicación) y crea las tablas"""
+        with self.lock:
+            if self.conn is not None:
+                return self.conn
+            # La conexión se comparte entre hilos protegida por self.lock;
+            # sqlite3 reutiliza las sentencias preparadas mientras siga abierta
+            self.conn = sqlite3.connect(self.path, check_same_thread=False,
+                                        cached_statements=64)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS members (
+                membership_id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                expiration_date TEXT NOT NULL,
+                expiration_day INTEGER
+            )''')
+            # El vencimiento también como número de día (date.toordinal) para consultas por rango
+            columns = {row[1] for row in self.conn.execute('PRAGMA table_info(members)')}
+            if 'expiration_day' not in columns:
+                self.conn.execute('ALTER TABLE members ADD COLUMN expiration_day INTEGER')
+            self.conn.execute('''
+            CREATE INDEX IF NOT EXISTS members_by_expiration ON members (expiration_day)''')
+            self._backfill_expiration_days()
+            # Registro de etiquetas: cada membership_id recibe un entero permanente
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS face_labels (
+                label INTEGER PRIMARY KEY AUTOINCREMENT,
+                membership_id TEXT NOT NULL UNIQUE
+            )''')
+            # Orden alfabético del buscador, recorrido página a página por este índice
+            self.conn.execute('''
+            CREATE INDEX IF NOT EXISTS members_by_name
+            ON members (name COLLATE NOCASE, membership_id)''')
+            self._create_search_index()
+            self.conn.commit()
+            return self.conn
+    
+    def _backfill_expiration_days(self):
+        """Calcula expiration_day de las filas antiguas con la misma conversión que las altas"""
+        rows = self.conn.execute(
+            'SELECT membership_id, expiration_date FROM members WHERE expiration_day IS NULL'
+        ).fetchall()
+        updates, invalid = [], []
+        for membership_id, exp_str in rows:
+            try:
+                day = day_number(str(exp_str).strip())
+            except ValueError:
+                invalid.append((membership_id, exp_str))
+                continue
+            # Se normaliza también el texto (2027-1-5 -> 2027-01-05)
+            updates.append((date.fromordinal(day).isoformat(), day, membership_id))
+        # Sin una fecha legible la membresía se da por vencida hasta corregirla al editar
+        updates += [(exp_str, 1, membership_id) for membership_id, exp_str in invalid]
+        self.conn.executemany('''
+            UPDATE members SET expiration_date = ?, expiration_day = ? WHERE membership_id = ?
+        ''', updates)
+        for membership_id, exp_str in invalid:
+            print(f"Miembro {membership_id}: fecha de expiración inválida {exp_str!r}; "
+                  f"se considera vencido hasta corregirla")
+    
+    def _create_search_index(self):
+        """Crea el índice FTS5 de nombre e ID, mantenido por triggers (si SQLite lo incluye)"""
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'members_fts'"
+        ).fetchone() is not None
+        try:
+            # Copia propia del texto: el rowid de members puede cambiar con VACUUM
+            self.conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS members_fts USING fts5(
+                membership_id, name,
+                tokenize = 'unicode61 remove_diacritics 2', prefix = '1 2 3'
+            )''')
+        except sqlite3.OperationalError:
+            # SQLite compilado sin FTS5: se busca por prefijo con LIKE
+            self.fts = False
+            return
+        self.conn.executescript('''
+            CREATE TRIGGER IF NOT EXISTS members_fts_insert AFTER INSERT ON members BEGIN
+                INSERT INTO members_fts (membership_id, name) VALUES (new.membership_id, new.name);
+            END;
+            CREATE TRIGGER IF NOT EXISTS members_fts_update AFTER UPDATE OF name ON members BEGIN
+                UPDATE members_fts SET name = new.name WHERE membership_id = old.membership_id;
+            END;
+            CREATE TRIGGER IF NOT EXISTS members_fts_delete AFTER DELETE ON members BEGIN
+                DELETE FROM members_fts WHERE membership_id = old.membership_id;
+            END;
+        ''')
+        if not exists:
+            # Base anterior al índice: indexar los miembros ya registrados
+            self.conn.execute(
+                'INSERT INTO members_fts (membership_id, name) SELECT membership_id, name FROM members'
+            )
+        self.fts = True
+    
+    def _load(self):
+        """Carga todos los miembros y etiquetas en memoria"""
+        conn = self.connect()
+        # Antes de leer: un cambio de otro proceso durante la carga se detecta en el próximo sync()
+        self._data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+        self._members = {
+            membership_id: (name, date.fromordinal(day))
+            for membership_id, name, day in conn.execute(
+                'SELECT membership_id, name, expiration_day FROM members'
+            )
+        }
+        self._labels = dict(conn.execute('SELECT membership_id, label FROM face_labels'))
+        self._access = None
+    
+    def sync(self, max_age=0):
+        """Recarga la caché si otro proceso (p. ej. la recepción) escribió en la base"""
+        if time.monotonic() - self._synced < max_age:
+            return
+        with self.lock:
+            self._synced = time.monotonic()
+            if self._members is None:
+                return
+            # data_version solo cambia con los commits de otras conexiones, no con los propios
+            version = self.connect().execute('PRAGMA data_version').fetchone()[0]
+            if version != self._data_version:
+                self._load()
+    
+    def _refresh(self, membership_id):
+        """Vuelve a leer un miembro tras escribirlo"""
+        row = self.conn.execute(
+            'SELECT name, expiration_day FROM members WHERE membership_id = ?',
+            (membership_id,)
+        ).fetchone()
+        if row is None:
+            self._members.pop(membership_id, None)
+        else:
+            self._members[membership_id] = (row[0], date.fromordinal(row[1]))
+        
+        # Actualizar solo su bit en una copia: quien leyó el bitmap anterior no lo ve cambiar
+        label = self._labels.get(membership_id)
+        if self._access is not None and label is not None:
+            today, active = self._access
+            if label >= len(active):
+                self._access = None
+                return
+            active = active.copy()
+            active[label] = row is not None and row[1] >= today
+            self._access = (today, active)
+    
+    def _build_access(self, today):
+        """Bitmap sobre las etiquetas permanentes: True si la membresía sigue vigente hoy"""
+        active = np.zeros(max(self._labels.values(), default=0) + 1, dtype=bool)
+        for membership_id, label in self._labels.items():
+            record = self._members.get(membership_id)
+            if record is not None and record[1].toordinal() >= today:
+                active[label] = True
+        self._access = (today, active)
+    
+    def access(self):
+        """(día de hoy, bitmap etiqueta -> vigente), reconstruido al cambiar el día o los datos"""
+        today = date.today().toordinal()
+        access = self._access
+        if access is not None and access[0] == today:
+            return access
+        with self.lock:
+            if self._members is None or (access is not None and access[0] != today):
+                # Cambio de día: releer de la base, no de una caché que puede llevar días abierta
+                self._load()
+            if self._access is None or self._access[0] != today:
+                self._build_access(today)
+            return self._access
+    
+    def expiring(self, days=EXPIRING_DAYS, include_expired=0):
+        """Miembros que vencen entre hoy - include_expired y hoy + days, por fecha (usa el índice)"""
+        today = date.today().toordinal()
+        with self.lock:
+            rows = self.connect().execute('''
+                SELECT membership_id, name, expiration_day FROM members
+                WHERE expiration_day BETWEEN ? AND ?
+                ORDER BY expiration_day, name COLLATE NOCASE
+            ''', (today - include_expired, today + days)).fetchall()
+        return [(membership_id, name, date.fromordinal(day)) for membership_id, name, day in rows]
+    
+    def get(self, membership_id):
+        """Devuelve (nombre, fecha de expiración) o None, sin consultar la BD"""
+        with self.lock:
+            if self._members is None:
+                self._load()
+            return self._members.get(membership_id)
+    
+    def all(self):
+        """Lista de (membership_id, nombre, fecha de expiración)"""
+        with self.lock:
+            if self._members is None:
+                self._load()
+            return [(membership_id, name, exp_date)
+                    for membership_id, (name, exp_date) in self._members.items()]
+    
+    def count(self):
+        """Número de miembros registrados"""
+        with self.lock:
+            if self._members is None:
+                self._load()
+            return len(self._members)
+    
+    def search(self, text="", after=None, limit=MEMBER_PAGE_SIZE):
+        """Página de miembros cuyo nombre o ID empieza por el texto, en orden alfabético
+        
+        after es (nombre, membership_id) de la última fila de la página anterior.
+        """
+        conditions, params = [], []
+        words = re.findall(r'\w+', text)
+        if words and self.fts:
+            # Todas las palabras, cada una como prefijo de una palabra del nombre o del ID
+            conditions.append(
+                'membership_id IN (SELECT membership_id FROM members_fts WHERE members_fts MATCH ?)'
+            )
+            params.append(" ".join(f'"{word}"*' for word in words))
+        elif text:
+            escaped = re.sub(r'([\\%_])', r'\\\1', text) + '%'
+            conditions.append("(name LIKE ? ESCAPE '\\' OR membership_id LIKE ? ESCAPE '\\')")
+            params += [escaped, escaped]
+        if after is not None:
+            conditions.append('(name COLLATE NOCASE, membership_id) > (?, ?)')
+            params += list(after)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self.lock:
+            rows = self.connect().execute(f'''
+                SELECT membership_id, name, expiration_day FROM members {where}
+                ORDER BY name COLLATE NOCASE, membership_id LIMIT ?
+            ''', params + [limit]).fetchall()
+        return [(membership_id, name, date.fromordinal(day)) for membership_id, name, day in rows]
+    
+    def add_many(self, rows):
+        """Inserta o actualiza (membership_id, nombre, fecha) en una sola transacción"""
+        with self.lock:
+            conn = self.connect()
+            with conn:
+                conn.executemany('''
+                    INSERT INTO members (membership_id, name, expiration_date, expiration_day)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (membership_id) DO UPDATE
+                    SET name = excluded.name, expiration_date = excluded.expiration_date,
+                        expiration_day = excluded.expiration_day
+                ''', [(member_id, name, exp_str, day_number(exp_str))
+                      for member_id, name, exp_str in rows])
+            self._load()
+    
+    def label_rows(self):
+        """Pares (etiqueta, membership_id) del registro de etiquetas"""
+        with self.lock:
+            return self.connect().execute(
+                'SELECT label, membership_id FROM face_labels ORDER BY label'
+            ).fetchall()
+    
+    def restore_labels(self, rows):
+        """Copia las etiquetas de otra instalación conservando sus números"""
+        with self.lock:
+            conn = self.connect()
+            with conn:
+                conn.executemany(
+                    'INSERT INTO face_labels (label, membership_id) VALUES (?, ?)', rows
+                )
+            self._load()
+    
+    def add(self, membership_id, name, exp_str):
+        """Inserta un miembro (sqlite3.IntegrityError si el ID ya existe)"""
+        with self.lock:
+            if self._members is None:
+                self._load()
+            with self.conn:
+                self.conn.execute('''
+                    INSERT INTO members (membership_id, name, expiration_date, expiration_day)
+                    VALUES (?, ?, ?, ?)
+                ''', (membership_id, name, exp_str, day_number(exp_str)))
+            self._refresh(membership_id)
+    
+    def update(self, membership_id, name, exp_str):
+        """Actualiza nombre y fecha de expiración de un miembro"""
+        with self.lock:
+            if self._members is None:
+                self._load()
+            with self.conn:
+                self.conn.execute('''
+                    UPDATE members 
+                    SET name = ?, expiration_date = ?, expiration_day = ?
+                    WHERE membership_id = ?
+                ''', (name, exp_str, day_number(exp_str), membership_id))
+            self._refresh(membership_id)
+    
+    def get_labels(self, member_ids):
+        """Devuelve la etiqueta permanente de cada membership_id, asignándola si no existe"""
+        with self.lock:
+            if self._labels is None:
+                self._load()
+            missing = [member_id for member_id in member_ids if member_id not in self._labels]
+            if missing:
+                with self.conn:
+                    self.conn.executemany(
+                        'INSERT OR IGNORE INTO face_labels (membership_id) VALUES (?)',
+                        [(member_id,) for member_id in missing]
+                    )
+                for member_id in missing:
+                    self._labels[member_id] = self.conn.execute(
+                        'SELECT label FROM face_labels WHERE membership_id = ?', (member_id,)
+                    ).fetchone()[0]
+                self._access = None
+            return {member_id: self._labels[member_id] for member_id in member_ids}
+    
+    def get_label(self, member_id):
+        """Devuelve la etiqueta permanente de un membership_id"""
+        return self.get_labels([member_id])[member_id]
+    
+    def close(self):
+        """Cierra la conexión y descarta las cachés"""
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+            self.conn = None
+            self._members = None
+            self._labels = None
+            self._access = None
+
+member_repo = MemberRepository()
+
+def init_db():
+    """Inicializa la base de datos"""
+    member_repo.connect()
+    ensure_dirs()
+
+# Preprocesamiento de rostros
+def align_face(face):
+    """Rota el rostro para que los ojos queden a la misma altura"""
+    h, w = face.shape[:2]
+    eyes = get_eye_cascade().detectMultiScale(
+        face[:h//2], scaleFactor=1.1, minNeighbors=5, minSize=(w//10, w//10)
+    )
+    if len(eyes) < 2:
+        return face
+    # Los dos ojos más grandes, de izquierda a derecha
+    eyes = sorted(sorted(eyes, key=lambda e: e[2] * e[3])[-2:], key=lambda e: e[0])
+    (x1, y1, w1, h1), (x2, y2, w2, h2) = eyes
+    left = (x1 + w1 / 2, y1 + h1 / 2)
+    right = (x2 + w2 / 2, y2 + h2 / 2)
+    angle = math.degrees(math.atan2(right[1] - left[1], right[0] - left[0]))
+    center = ((left[0] + right[0]) / 2, (left[1] + right[1]) / 2)
+    rotation = cv.getRotationMatrix2D(center, angle, 1.0)
+    return cv.warpAffine(face, rotation, (w, h), flags=cv.INTER_LINEAR,
+                         borderMode=cv.BORDER_REPLICATE)
+
+def preprocess_face(roi):
+    """Normaliza un rostro: alineación opcional, tamaño fijo y ecualización"""
+    if roi.ndim == 3:
+        roi = cv.cvtColor(roi, cv.COLOR_BGR2GRAY)
+    if ALIGN_EYES:
+        roi = align_face(roi)
+    face = cv.resize(roi, FACE_SIZE, interpolation=cv.INTER_AREA)
+    if USE_CLAHE:
+        # Se crea en cada llamada: el objeto CLAHE no es seguro entre hilos
+        return cv.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(face)
+    return cv.equalizeHist(face)
+
+class SampleStore:
+    """Rostros normalizados empaquetados en un arreglo uint8 con mmap y un índice por miembro"""
+    def __init__(self, path=SAMPLE_STORE_PATH):
+        self.path = path
+        self.lock = threading.RLock()
+        self.index = None
+        self.index_mtime = None
+        self.mapped = None
+        self.readers = Counter()  # Archivo de datos -> entrenamientos que lo están leyendo
+        self.superseded = set()   # Archivos reemplazados que se borran cuando nadie los lee
+    
+    def data_path(self, name):
+        """Ruta de un archivo de datos del almacén, junto a su índice"""
+        return os.path.join(os.path.dirname(os.path.abspath(self.path)), name)
+    
+    def _empty_index(self):
+        return {
+            "version": PREPROCESS_VERSION,
+            "face_size": list(FACE_SIZE),
+            "data": None,
+            "rows": 0,
+            "generation": 0,
+            "members": {}
+        }
+    
+    def _refresh(self):
+        """Relee el índice si otro proceso lo reemplazó"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if self.index is not None and mtime == self.index_mtime:
+            return self.index
+        index = self._empty_index()
+        if mtime is not None:
+            try:
+                with open(self.path, encoding='utf-8') as file:
+                    index = json.load(file)
+            except (OSError, ValueError) as e:
+                print(f"Índice de muestras no válido ({e}); se usa un almacén vacío")
+        self.index = index
+        self.index_mtime = mtime
+        self.mapped = None
+        return index
+    
+    def _write_index(self, index):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(index, file)
+        os.replace(tmp_path, self.path)
+        self.index = index
+        self.index_mtime = os.stat(self.path).st_mtime_ns
+    
+    def _array(self):
+        """Vista mmap de las filas confirmadas (los datos sin índice se ignoran)"""
+        index = self._refresh()
+        width, height = index["face_size"]
+        if not index["rows"]:
+            return np.empty((0, height, width), dtype=np.uint8)
+        if self.mapped is None or len(self.mapped) != index["rows"]:
+            self.mapped = np.memmap(self.data_path(index["data"]), dtype=np.uint8, mode='r',
+                                    shape=(index["rows"], height, width))
+        return self.mapped
+    
+    def exists(self):
+        return os.path.isfile(self.path)
+    
+    def version(self):
+        with self.lock:
+            return self._refresh().get("version", 0)
+    
+    def signature(self):
+        """Identifica el contenido actual sin leer las muestras"""
+        with self.lock:
+            index = self._refresh()
+            return f"{index['data']}:{index['rows']}:{index['generation']}"
+    
+    def member_ids(self):
+        with self.lock:
+            return list(self._refresh()["members"])
+    
+    def __len__(self):
+        with self.lock:
+            return len(self._refresh()["members"])
+    
+    def get(self, member_id):
+        """Muestras de un miembro como vista del mmap (sin copiar) o None"""
+        with self.lock:
+            entry = self._refresh()["members"].get(member_id)
+            if entry is None:
+                return None
+            start, count = entry
+            return self._array()[start:start + count]
+    
+    def items(self):
+        """Pares (membership_id, muestras) de todos los miembros, sin copiar"""
+        with self.lock:
+            index = self._refresh()
+            array = self._array()
+            return [(member_id, array[start:start + count])
+                    for member_id, (start, count) in index["members"].items()]
+    
+    def layout(self):
+        """Archivo de datos, forma del mmap y tramos (membership_id, inicio, cantidad)"""
+        with self.lock:
+            index = self._refresh()
+            width, height = index["face_size"]
+            data_path = self.data_path(index["data"]) if index["data"] else None
+            segments = [(member_id, start, count)
+                        for member_id, (start, count) in index["members"].items()]
+            return data_path, (index["rows"], height, width), segments
+    
+    @contextlib.contextmanager
+    def reading(self):
+        """Fija el archivo de datos vigente mientras dura el bloque y devuelve su layout()
+        
+        Los procesos de entrenamiento lo reabren por ruta: un rewrite no lo borra hasta que se suelta.
+        """
+        with self.lock:
+            layout = self.layout()
+            name = self._refresh()["data"]
+            if name:
+                self.readers[name] += 1
+        try:
+            yield layout
+        finally:
+            if name:
+                with self.lock:
+                    self.readers[name] -= 1
+                    if not self.readers[name]:
+                        del self.readers[name]
+                        if name in self.superseded:
+                            self.superseded.discard(name)
+                            self._remove_data(name)
+    
+    def _remove_data(self, name):
+        """Borra un archivo de datos reemplazado; en Windows puede fallar si sigue mapeado"""
+        try:
+            os.remove(self.data_path(name))
+        except OSError:
+            pass
+    
+    def put(self, member_id, faces):
+        """Añade las muestras de un miembro al final y reemplaza su entrada del índice"""
+        with self.lock:
+            self.put_many([(member_id, faces)])
+            return self.get(member_id)
+    
+    def put_many(self, entries):
+        """Añade las muestras de varios miembros con una sola escritura de datos e índice"""
+        stacks = [(member_id, np.ascontiguousarray(np.stack(faces), dtype=np.uint8))
+                  for member_id, faces in entries]
+        if not stacks:
+            return
+        with self.lock:
+            index = dict(self._refresh())
+            width, height = index["face_size"]
+            if any(stack.shape[1:] != (height, width) for _, stack in stacks):
+                raise ValueError(f"Las muestras deben medir {tuple(index['face_size'])}")
+            if index["data"] is None:
+                index["data"] = self._new_data_name(index)
+            
+            # Escribir los datos antes que el índice: un corte deja filas sin referenciar
+            with open(self.data_path(index["data"]), 'ab') as file:
+                file.truncate(index["rows"] * width * height)
+                for _, stack in stacks:
+                    file.write(stack.tobytes())
+                file.flush()
+                os.fsync(file.fileno())
+            
+            index["members"] = dict(index["members"])
+            for member_id, stack in stacks:
+                index["members"][member_id] = [index["rows"], len(stack)]
+                index["rows"] += len(stack)
+            index["generation"] += 1
+            self._write_index(index)
+            
+            used = sum(count for _, count in index["members"].values())
+            if index["rows"] - used > SAMPLE_STORE_MAX_GARBAGE * index["rows"]:
+                self.rewrite(self.items())
+    
+    def files(self):
+        """Nombre del archivo de datos vigente (o None) y ruta del índice"""
+        with self.lock:
+            return self._refresh()["data"], self.path
+    
+    def remove(self, member_id):
+        """Quita a un miembro del índice (sus filas se liberan al reescribir)"""
+        with self.lock:
+            index = dict(self._refresh())
+            if member_id not in index["members"]:
+                return
+            index["members"] = {m: e for m, e in index["members"].items() if m != member_id}
+            index["generation"] += 1
+            self._write_index(index)
+    
+    def _new_data_name(self, index):
+        base = os.path.splitext(os.path.basename(self.path))[0]
+        return f"{base}.{index['generation'] + 1}.bin"
+    
+    def rewrite(self, entries, version=PREPROCESS_VERSION):
+        """Escribe un archivo de datos nuevo solo con `entries` y cambia el índice de forma atómica"""
+        with self.lock:
+            old = self._refresh()
+            index = self._empty_index()
+            index["version"] = version
+            index["generation"] = old["generation"]
+            index["data"] = self._new_data_name(old)
+            with open(self.data_path(index["data"]), 'wb') as file:
+                for member_id, faces in entries:
+                    stack = np.ascontiguousarray(faces, dtype=np.uint8)
+                    if not len(stack):
+                        continue
+                    file.write(stack.tobytes())
+                    index["members"][member_id] = [index["rows"], len(stack)]
+                    index["rows"] += len(stack)
+                file.flush()
+                os.fsync(file.fileno())
+            index["generation"] += 1
+            self._write_index(index)
+            self.mapped = None
+            
+            # Las vistas abiertas siguen siendo válidas; un entrenamiento en curso lo borra al terminar
+            if old["data"] and old["data"] != index["data"]:
+                if self.readers[old["data"]]:
+                    self.superseded.add(old["data"])
+                else:
+                    self._remove_data(old["data"])
+    
+    def migrate(self):
+        """Vuelve a normalizar las muestras guardadas con un preprocesado anterior"""
+        entries = [(member_id, np.stack([preprocess_face(face) for face in faces]))
+                   for member_id, faces in self.items()]
+        self.rewrite(entries)
+        return len(entries)
+    
+    def import_dir(self, directory=SAMPLES_DIR):
+        """Incorpora las muestras de un directorio con el formato de face_samples/"""
+        outdated = samples_format_version(directory) != PREPROCESS_VERSION
+        by_member = {}
+        for f in sorted(os.listdir(directory)):
+            member_id, ext = os.path.splitext(f)
+            if ext.lower() not in SAMPLE_EXTS:
+                continue
+            stack = load_member_samples(os.path.join(directory, f))
+            if stack is None or not len(stack):
+                continue
+            # Las imágenes sueltas ya salen normalizadas; los .npy antiguos se normalizan de nuevo
+            if ext.lower() == '.npy' and (outdated or stack.shape[1:] != FACE_SIZE[::-1]):
+                stack = np.stack([preprocess_face(face) for face in stack])
+            by_member.setdefault(member_id, []).extend(stack)
+        
+        with self.lock:
+            entries = [(member_id, faces) for member_id, faces in self.items()
+                       if member_id not in by_member]
+            entries += [(member_id, np.stack(faces)) for member_id, faces in by_member.items()]
+            self.rewrite(entries)
+        return len(by_member)
+    
+    def export_dir(self, directory=SAMPLES_DIR):
+        """Escribe un .npy por miembro en un directorio con el formato de face_samples/"""
+        os.makedirs(directory, exist_ok=True)
+        items = self.items()
+        for member_id, faces in items:
+            with open(os.path.join(directory, f"{member_id}.npy"), 'wb') as file:
+                np.save(file, np.asarray(faces))
+        with open(os.path.join(directory, 'format.json'), 'w', encoding='utf-8') as file:
+            json.dump({"version": self.version(), "face_size": self._refresh()["face_size"]}, file)
+        return len(items)
+
+sample_store = SampleStore()
+
+def prepare_samples():
+    """Crea el almacén a partir de face_samples/ la primera vez o lo migra si quedó antiguo"""
+    if sample_store.exists():
+        if sample_store.version() != PREPROCESS_VERSION:
+            return sample_store.migrate()
+        return 0
+    return sample_store.import_dir(SAMPLES_DIR)
+
+def save_member_samples(member_id, faces):
+    """Guarda todas las muestras (ya normalizadas) de un miembro en el almacén empaquetado"""
+    return sample_store.put(member_id, faces)
+
+def load_member_samples(path):
+    """Carga las muestras de un archivo (.npy apilado o imagen suelta)"""
+    if path.lower().endswith('.npy'):
+        try:
+            return np.load(path)
+        except (OSError, ValueError):
+            return None
+    # Las imágenes sueltas son muestras antiguas sin normalizar
+    img = cv.imread(path, cv.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+    return preprocess_face(img)[np.newaxis]
+
+def samples_format_version(directory=SAMPLES_DIR):
+    """Versión de preprocesamiento de las muestras .npy de un directorio como face_samples/"""
+    try:
+        with open(os.path.join(directory, 'format.json'), encoding='utf-8') as file:
+            return json.load(file).get("version", 0)
+    except (OSError, ValueError):
+        return 0
+
+# Entrenamiento completo, repartido en un grupo de procesos
+_training = {"active": False, "done": 0, "total": 0}
+
+def training_progress():
+    """Estado del entrenamiento completo en curso (lo consulta la interfaz)"""
+    return dict(_training)
+
+def _train_tasks(segments, chunk):
+    """Agrupa tramos (inicio, cantidad) del almacén en tareas de unas `chunk` filas"""
+    tasks, current, size = [], [], 0
+    for start, count in segments:
+        while count:
+            take = min(count, chunk - size)
+            current.append((start, take))
+            start, count, size = start + take, count - take, size + take
+            if size == chunk:
+                tasks.append(current)
+                current, size = [], 0
+    if current:
+        tasks.append(current)
+    return tasks
+
+def _train_chunk(data_path, shape, segments, params):
+    """Histogramas de varios tramos del almacén (se ejecuta en un proceso del grupo)"""
+    data = np.memmap(data_path, dtype=np.uint8, mode='r', shape=shape)
+    faces = [face for start, count in segments for face in data[start:start + count]]
+    return NumpyLBPH(*params).compute_histograms(faces)
+
+def extract_histograms(data_path, shape, segments, extractor, workers=None, progress=None):
+    """Calcula en paralelo los histogramas de los tramos del almacén, en orden"""
+    total = sum(count for _, count in segments)
+    out = np.empty((total, extractor.dims), dtype=np.float32)
+    tasks = _train_tasks(segments, TRAIN_CHUNK)
+    offsets = itertools.accumulate([sum(count for _, count in task) for task in tasks], initial=0)
+    params = (extractor.radius, extractor.neighbors, extractor.grid_x, extractor.grid_y)
+    
+    def store(offset, block):
+        out[offset:offset + len(block)] = block
+        _training["done"] += len(block)
+        if progress is not None:
+            progress(_training["done"], total)
+    
+    _training.update(active=True, done=0, total=total)
+    try:
+        if total < TRAIN_PARALLEL_MIN or workers == 1:
+            for task, offset in zip(tasks, offsets):
+                store(offset, _train_chunk(data_path, shape, task, params))
+        else:
+            # Cada proceso abre el mismo mmap: solo viajan los tramos y los histogramas
+            with ProcessPoolExecutor(max_workers=workers,
+                                     mp_context=multiprocessing.get_context('spawn')) as pool:
+                futures = {pool.submit(_train_chunk, data_path, shape, task, params): offset
+                           for task, offset in zip(tasks, offsets)}
+                for future in as_completed(futures):
+                    store(futures[future], future.result())
+    finally:
+        _training["active"] = False
+    return out
+
+def train_recognizer(model, workers=TRAIN_WORKERS, progress=None, layout=None):
+    """Entrena el reconocedor facial y devuelve el mapa etiqueta -> membership_id"""
+    if layout is None:
+        # Sin layout fijado por quien llama: fijar el archivo vigente durante el entrenamiento
+        with sample_store.reading() as layout:
+            return train_recognizer(model, workers, progress, layout)
+    data_path, shape, segments = layout
+    segments = [(member_id, start, count) for member_id, start, count in segments if count]
+    ids = [member_id for member_id, _, _ in segments]
+    if not segments:
+        return {}
+    
+    # Entrenamiento en lote con todas las muestras de todos los miembros
+    label_of = member_repo.get_labels(ids)
+    labels = np.concatenate([
+        np.full(count, label_of[member_id], dtype=np.int32)
+        for member_id, _, count in segments
+    ])
+    if isinstance(model, NumpyLBPH):
+        histograms = extract_histograms(
+            data_path, shape, [(start, count) for _, start, count in segments],
+            model, workers, progress
+        )
+        model.set_histograms(histograms, labels)
+    else:
+        # cv.face no acepta histogramas calculados fuera: entrena aquí con vistas del mmap
+        data = np.memmap(data_path, dtype=np.uint8, mode='r', shape=shape)
+        model.train([face for _, start, count in segments for face in data[start:start + count]],
+                    labels)
+    return {label_of[member_id]: member_id for member_id in ids}
+
+# Búsqueda en dos etapas sobre los histogramas del modelo
+class SampleTail:
+    """Filas añadidas tras el modelo base, con capacidad de reserva compartida entre versiones"""
+    def __init__(self, dims, capacity):
+        self.histograms = np.empty((capacity, dims), dtype=np.float32)
+        self.sums = np.empty(capacity, dtype=np.float64)
+        self.labels = np.empty(capacity, dtype=np.int32)
+        self.length = 0  # Filas escritas; cada versión solo ve las que tenía al publicarse
+        self.lock = threading.Lock()
+    
+    def appended(self, rows, histograms, labels):
+        """Añade filas tras las `rows` primeras; devuelve el búfer que las contiene"""
+        count = len(labels)
+        with self.lock:
+            # Se escribe en sitio si nadie añadió ya tras ese prefijo y hay espacio reservado
+            if rows == self.length and rows + count <= len(self.labels):
+                target = self
+            else:
+                target = SampleTail(self.histograms.shape[1],
+                                    max(2 * (rows + count), MATCHER_TAIL_CAPACITY))
+                for name in ("histograms", "sums", "labels"):
+                    getattr(target, name)[:rows] = getattr(self, name)[:rows]
+            stop = rows + count
+            target.histograms[rows:stop] = histograms
+            target.sums[rows:stop] = histograms.sum(axis=1, dtype=np.float64)
+            target.labels[rows:stop] = labels
+            target.length = stop
+        return target
+
+class HistogramMatcher:
+    """Preselección vectorizada de candidatos y verificación chi-cuadrado exacta, como LBPH"""
+    def __init__(self, model):
+        if isinstance(model, NumpyLBPH):
+            # Comparte los histogramas (quizá en mmap) del reconocedor NumPy
+            self.extractor = model
+            self.dims = model.dims
+            self.histograms = model.histograms
+            self.labels = model.labels.copy()
+            self.sums = model.sums
+        else:
+            # Mismos histogramas que cv.face, calculados con la extracción vectorizada
+            self.extractor = NumpyLBPH(
+                model.getRadius(), model.getNeighbors(), model.getGridX(), model.getGridY()
+            )
+            self.dims = self.extractor.dims
+            histograms = model.getHistograms()
+            self.histograms = (np.vstack(histograms).astype(np.float32, copy=False)
+                               if histograms else np.empty((0, self.dims), dtype=np.float32))
+            self.labels = (model.getLabels().ravel().astype(np.int32)
+                           if histograms else np.empty(0, dtype=np.int32))
+            self.sums = self.histograms.sum(axis=1, dtype=np.float64)
+        
+        # Componentes principales de la raíz de los histogramas (distancia de Hellinger)
+        self.projection, self.projected = self._fit_projection()
+        self.projected_sq = np.einsum('ij,ij->i', self.projected, self.projected)
+        # Las altas incrementales van a un búfer aparte: el modelo base (quizá en mmap) no se copia
+        self.tail = None
+        self.tail_rows = 0
+        self._allowed = (None, None)  # Último bitmap de vigencia y su máscara por fila
+    
+    def __len__(self):
+        return len(self.labels) + self.tail_rows
+    
+    def _segments(self):
+        """Partes visibles en esta versión: (primera fila, histogramas, sumas, etiquetas)"""
+        yield 0, self.histograms, self.sums, self.labels
+        if self.tail_rows:
+            tail, rows = self.tail, self.tail_rows
+            yield len(self.labels), tail.histograms[:rows], tail.sums[:rows], tail.labels[:rows]
+    
+    def all_labels(self):
+        """Etiqueta de cada fila, del modelo base y de las altas"""
+        if not self.tail_rows:
+            return self.labels
+        return np.concatenate([self.labels, self.tail.labels[:self.tail_rows]])
+    
+    def _blocks(self):
+        """Raíz de los histogramas base por bloques, para no duplicar la matriz completa en memoria"""
+        for start in range(0, len(self.labels), MATCHER_CHUNK_ROWS):
+            yield start, np.sqrt(self.histograms[start:start + MATCHER_CHUNK_ROWS])
+    
+    def _fit_projection(self):
+        """Base PCA aleatorizada (una iteración de potencia) y proyección de las filas base"""
+        # Una proyección aleatoria fija perdía al vecino exacto en la mitad de las consultas
+        # difíciles; las componentes principales de este mismo modelo lo conservan
+        rows = len(self.labels)
+        if rows <= MATCHER_SHORTLIST:
+            return None, np.empty((rows, 0), dtype=np.float32)
+        rank = min(MATCHER_PROJECTION_DIMS + 16, rows)
+        omega = np.random.default_rng(0).standard_normal((rows, rank)).astype(np.float32)
+        mean = np.zeros(self.dims, dtype=np.float64)
+        sketch = np.zeros((self.dims, rank), dtype=np.float32)
+        for start, block in self._blocks():
+            mean += block.sum(axis=0, dtype=np.float64)
+            sketch += block.T @ omega[start:start + len(block)]
+        mean = (mean / rows).astype(np.float32)
+        # Las filas centradas no se materializan: se corrige el producto con la media
+        sketch -= np.outer(mean, omega.sum(axis=0))
+        basis = np.linalg.qr(sketch)[0]
+        reduced = np.empty((rows, basis.shape[1]), dtype=np.float32)
+        for start, block in self._blocks():
+            reduced[start:start + len(block)] = block @ basis
+        reduced -= mean @ basis
+        sketch = np.zeros_like(basis)
+        for start, block in self._blocks():
+            sketch += block.T @ reduced[start:start + len(block)]
+        sketch -= np.outer(mean, reduced.sum(axis=0))
+        basis = np.linalg.qr(sketch)[0]
+        offset = mean @ basis
+        for start, block in self._blocks():
+            reduced[start:start + len(block)] = block @ basis
+        reduced -= offset
+        components = np.linalg.svd(reduced, full_matrices=False)[2][:MATCHER_PROJECTION_DIMS].T
+        # Sin centrar: las distancias no cambian al trasladar la consulta y las filas
+        return ((basis @ components).astype(np.float32),
+                ((reduced + offset) @ components).astype(np.float32))
+    
+    def histogram(self, roi):
+        """Histograma LBP espacial de un rostro con los parámetros del modelo"""
+        return self.extractor.compute_histograms([roi])[0]
+    
+    def extended(self, faces, labels):
+        """Copia con muestras añadidas; la instancia original no cambia"""
+        # Copia superficial: comparte el modelo base y el búfer de altas, del que solo ve su prefijo
+        clone = copy.copy(self)
+        clone.add(faces, labels)
+        return clone
+    
+    def add(self, faces, labels):
+        """Añade las muestras de una actualización incremental del modelo"""
+        histograms = self.extractor.compute_histograms(list(faces))
+        tail = self.tail or SampleTail(self.dims, MATCHER_TAIL_CAPACITY)
+        # Solo se copian las filas nuevas (y el búfer de altas si hay que agrandarlo)
+        self.tail = tail.appended(self.tail_rows, histograms, np.asarray(labels, dtype=np.int32))
+        self.tail_rows += len(histograms)
+        self._allowed = (None, None)
+    
+    def allowed_rows(self, active):
+        """Máscara de filas cuya etiqueta está vigente (las etiquetas fuera del bitmap se admiten)"""
+        # El bitmap se reemplaza en cada cambio, así que basta compararlo por identidad
+        cached, mask = self._allowed
+        if cached is active:
+            return mask
+        labels = self.all_labels()
+        mask = np.ones(len(labels), dtype=bool)
+        known = labels < len(active)
+        mask[known] = active[labels[known]]
+        self._allowed = (active, mask)
+        return mask
+    
+    def shortlist(self, query, allowed=None):
+        """Índices de los candidatos: los más cercanos del modelo base según la proyección y todas las altas"""
+        rows = np.arange(len(self)) if allowed is None else np.flatnonzero(allowed)
+        base = len(self.labels)
+        if len(rows) <= max(MATCHER_EXACT_BELOW, MATCHER_SHORTLIST) or self.projection is None:
+            return rows
+        # Las altas no entraron en el ajuste de la proyección: se comparan siempre en exacto
+        # (son pocas, la compactación las pasa al modelo base)
+        q = np.sqrt(query.astype(np.float32)) @ self.projection
+        approx = self.projected_sq - 2.0 * (self.projected @ q)
+        if allowed is not None:
+            approx[~allowed[:base]] = np.inf
+        nearest = np.argpartition(approx, MATCHER_SHORTLIST)[:MATCHER_SHORTLIST]
+        if allowed is not None:
+            nearest = nearest[allowed[nearest]]
+        return np.concatenate([nearest, rows[rows >= base]])
+    
+    def predict(self, roi, active=None):
+        """Devuelve (etiqueta, distancia) del vecino más cercano, como recognizer.predict
+        
+        Con `active` (bitmap etiqueta -> vigente) solo compite quien tiene la membresía al día.
+        """
+        if not len(self):
+            return -1, float('inf')
+        query = self.histogram(roi).astype(np.float64)
+        candidates = self.shortlist(query, None if active is None else self.allowed_rows(active))
+        if not len(candidates):
+            return -1, float('inf')
+        best_label, best_distance = -1, float('inf')
+        for first, histograms, sums, labels in self._segments():
+            rows = candidates[(candidates >= first) & (candidates < first + len(labels))] - first
+            for start in range(0, len(rows), MATCHER_CHUNK_ROWS):
+                block = rows[start:start + MATCHER_CHUNK_ROWS]
+                distances = chi_square_distances(histograms, sums, query, block)
+                i = int(np.argmin(distances))
+                if distances[i] < best_distance:
+                    best_label, best_distance = int(labels[block[i]]), float(distances[i])
+        return best_label, best_distance
+
+# Versiones del modelo: se publican completas y no se modifican después
+class ModelHandle:
+    """Versión inmutable del modelo en uso: buscador de histogramas, etiquetas y huella"""
+    def __init__(self, version, matcher, labels, fingerprint):
+        self.version = version
+        self.matcher = matcher
+        self.labels = labels
+        self.fingerprint = fingerprint
+    
+    def predict(self, roi, active=None):
+        return self.matcher.predict(roi, active)
+
+_model_state = {"current": ModelHandle(0, None, {}, None)}
+_model_lock = threading.RLock()  # Solo serializa a quienes publican; las predicciones no lo usan
+
+def current_model():
+    """Versión vigente; quien la obtiene puede seguir usándola aunque se publique otra"""
+    return _model_state["current"]
+
+def publish_model(matcher, labels, fingerprint):
+    """Reemplaza de forma atómica la versión vigente por una nueva"""
+    with _model_lock:
+        handle = ModelHandle(current_model().version + 1, matcher, labels, fingerprint)
+        _model_state["current"] = handle
+        return handle
+
+# Persistencia del modelo
+
+def samples_fingerprint():
+    """Calcula una huella del almacén de muestras (archivo de datos, filas y generación)"""
+    digest = hashlib.sha1(f"preprocess:{PREPROCESS_VERSION}\n".encode('utf-8'))
+    digest.update(sample_store.signature().encode('utf-8'))
+    return digest.hexdigest()
+
+def save_model(labels, fingerprint, model):
+    """Guarda el modelo entrenado y el mapa etiqueta -> membership_id"""
+    path = model_path()
+    base, ext = os.path.splitext(path)
+    tmp_model = base + '.tmp' + ext  # cv.face elige el formato por la extensión
+    model.write(tmp_model)
+    os.replace(tmp_model, path)
+    
+    tmp_meta = MODEL_META_PATH + '.tmp'
+    with open(tmp_meta, 'w', encoding='utf-8') as file:
+        json.dump({"fingerprint": fingerprint, "backend": recognizer_backend(), "labels": labels}, file)
+    os.replace(tmp_meta, MODEL_META_PATH)
+
+def load_model(fingerprint):
+    """Carga en una instancia nueva el modelo guardado si corresponde a la huella indicada"""
+    path = model_path()
+    if not (os.path.isfile(path) and os.path.isfile(MODEL_META_PATH)):
+        return None
+    try:
+        with open(MODEL_META_PATH, encoding='utf-8') as file:
+            meta = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if meta.get("fingerprint") != fingerprint or "labels" not in meta:
+        return None
+    if meta.get("backend", "opencv") != recognizer_backend():
+        return None
+    model = create_recognizer()
+    try:
+        model.read(path)
+    except (cv.error, OSError, ValueError):
+        return None
+    # JSON guarda las claves como texto
+    return model, {int(label): member_id for label, member_id in meta.get("labels", {}).items()}
+
+def ensure_model(block=True):
+    """Devuelve el mapa etiqueta -> membership_id, reentrenando solo si las muestras cambiaron"""
+    fingerprint = samples_fingerprint()
+    handle = current_model()
+    if fingerprint == handle.fingerprint:
+        return handle.labels
+    
+    with _model_lock:
+        loaded = load_model(fingerprint)
+        if loaded is not None:
+            model, labels = loaded
+            return publish_model(HistogramMatcher(model), labels, fingerprint).labels
+    
+    # Reentrenar en una instancia nueva; mientras tanto se sigue usando la versión vigente
+    if not block:
+        schedule_compaction(0)
+        return handle.labels
+    compact_model()
+    return current_model().labels
+
+def rebuild_model(workers=TRAIN_WORKERS, progress=None):
+    """Reentrena y guarda el modelo completo aunque las muestras no hayan cambiado"""
+    fingerprint = samples_fingerprint()
+    model = create_recognizer()
+    labels = train_recognizer(model, workers, progress)
+    if labels:
+        save_model(labels, fingerprint, model)
+    return labels
+
+def predict_face(roi):
+    """Predice la etiqueta de un rostro con el modelo vigente"""
+    with metrics.span("predict"):
+        active = member_repo.access()[1] if SKIP_EXPIRED_MEMBERS else None
+        return current_model().predict(roi, active)
+
+# Prueba de vida sobre los recortes de rostro que ya produce la detección
+class LivenessCheck:
+    """Comprobación de vida: observa recortes en gris y da True (vivo), False (suplantación) o None"""
+    name = "check"
+    budget_ms = 1.0  # Coste máximo por fotograma; si se supera, se ejecuta cada N fotogramas
+    
+    def reset(self):
+        """Olvida lo observado del intento anterior"""
+    
+    def observe(self, face):
+        """Analiza el recorte de rostro de un fotograma"""
+    
+    def verdict(self):
+        """Resultado con lo observado hasta ahora"""
+        return None
+
+class MotionCheck(LivenessCheck):
+    """Movimiento no rígido: una foto o pantalla plana se mueve con una transformación afín, un rostro real no"""
+    name = "motion"
+    budget_ms = 3.0
+    SIZE = 64
+    
+    def __init__(self):
+        self.previous = None
+        self.peak = 0.0
+        # Ajuste afín por mínimos cuadrados sobre la zona interior del recorte
+        margin = self.SIZE // 8
+        ys, xs = np.mgrid[margin:self.SIZE - margin, margin:self.SIZE - margin]
+        self.inner = slice(margin, self.SIZE - margin)
+        self.points = np.column_stack([xs.ravel(), ys.ravel(), np.ones(xs.size)]).astype(np.float32)
+    
+    def reset(self):
+        self.previous = None
+        self.peak = 0.0
+    
+    def observe(self, face):
+        current = cv.resize(face, (self.SIZE, self.SIZE), interpolation=cv.INTER_AREA)
+        previous, self.previous = self.previous, current
+        if previous is None:
+            return
+        flow = cv.calcOpticalFlowFarneback(previous, current, None, 0.5, 2, 9, 3, 5, 1.1, 0)
+        flow = flow[self.inner, self.inner].reshape(-1, 2)
+        # Solo cuentan los píxeles con textura: en zonas lisas el flujo no está determinado
+        gradient = cv.magnitude(cv.Sobel(current, cv.CV_32F, 1, 0), cv.Sobel(current, cv.CV_32F, 0, 1))
+        gradient = gradient[self.inner, self.inner].ravel()
+        textured = gradient >= np.quantile(gradient, 1.0 - LIVENESS_GRADIENT_KEEP)
+        points, flow = self.points[textured], flow[textured]
+        # Lo que queda tras quitar desplazamiento, giro, escala e inclinación es deformación
+        residual = flow - points @ np.linalg.lstsq(points, flow, rcond=None)[0]
+        self.peak = max(self.peak, float(np.percentile(np.hypot(residual[:, 0], residual[:, 1]), 95)))
+    
+    def verdict(self):
+        return True if self.peak >= LIVENESS_MOTION_LIVE else None
+
+class BlinkCheck(LivenessCheck):
+    """Parpadeo: la franja de los ojos se aclara al cerrarlos y vuelve a oscurecerse"""
+    name = "blink"
+    budget_ms = 0.5
+    
+    def __init__(self):
+        self.ratios = deque()  # (instante, brillo relativo) dentro de la ventana de tiempo
+    
+    def reset(self):
+        self.ratios.clear()
+    
+    def observe(self, face):
+        h, w = face.shape[:2]
+        eyes = face[int(h * 0.2):int(h * 0.45), int(w * 0.15):int(w * 0.85)]
+        # Relativo al rostro completo para no confundir un cambio de luz con un parpadeo
+        now = time.monotonic()
+        self.ratios.append((now, float(eyes.mean()) / max(float(face.mean()), 1.0)))
+        while now - self.ratios[0][0] > LIVENESS_MAX_SECONDS:
+            self.ratios.popleft()
+    
+    def verdict(self):
+        ratios = [ratio for _, ratio in self.ratios]
+        lowest_before = float('inf')
+        for i in range(1, len(ratios) - 1):
+            lowest_before = min(lowest_before, ratios[i - 1])
+            rise = ratios[i] * LIVENESS_BLINK_RISE
+            if ratios[i] - lowest_before >= rise and ratios[i] - min(ratios[i + 1:]) >= rise:
+                return True
+        return None
+
+class TextureCheck(LivenessCheck):
+    """Muaré: la rejilla de píxeles de una pantalla deja picos aislados en el espectro alto"""
+    name = "texture"
+    budget_ms = 2.0
+    SIZE = 128
+    
+    def __init__(self):
+        self.flags = []
+        self.window = None
+        self.band = None
+        self.weight = None
+    
+    def reset(self):
+        self.flags = []
+    
+    def observe(self, face):
+        if self.window is None:
+            self.window = cv.createHanningWindow((self.SIZE, self.SIZE), cv.CV_32F)
+            radius = np.hypot(np.fft.fftfreq(self.SIZE)[:, None], np.fft.rfftfreq(self.SIZE)[None, :])
+            self.band = radius >= 0.15
+            # Compensa la caída ~1/f del espectro de una imagen natural
+            self.weight = radius[self.band]
+        patch = cv.resize(face, (self.SIZE, self.SIZE), interpolation=cv.INTER_AREA).astype(np.float32)
+        patch = (patch - patch.mean()) * self.window
+        spectrum = np.abs(np.fft.rfft2(patch))[self.band] * self.weight
+        self.flags.append(spectrum.max() >= LIVENESS_MOIRE_RATIO * max(float(np.median(spectrum)), 1e-6))
+    
+    def verdict(self):
+        # La mayoría de los fotogramas con muaré marca suplantación
+        if len(self.flags) >= LIVENESS_MIN_FRAMES and sum(self.flags) * 2 > len(self.flags):
+            return False
+        return None
+
+class LivenessStage:
+    """Combina comprobaciones de vida respetando el presupuesto de tiempo de cada una"""
+    def __init__(self, checks=None):
+        self.checks = checks if checks is not None else [MotionCheck(), BlinkCheck(), TextureCheck()]
+        self.costs = {check.name: None for check in self.checks}  # ms medios por ejecución
+        self.strides = {check.name: 1 for check in self.checks}
+        self.frames = 0
+        self.started = None  # Primer fotograma del intento (la ventana se mide en tiempo, no en fotogramas)
+        self.center = None  # Centro suavizado del recorte
+        self.size = None  # Tamaño del recorte, fijo durante el intento
+    
+    def reset(self):
+        """Empieza un intento nuevo; el coste medido de cada comprobación se conserva"""
+        self.frames = 0
+        self.started = None
+        self.center = None
+        self.size = None
+        for check in self.checks:
+            check.reset()
+    
+    def crop(self, gray, box):
+        """Recorte estable del rostro: centro suavizado y tamaño fijo durante el intento"""
+        # El recuadro de Haar oscila unos píxeles entre fotogramas aunque la imagen esté quieta;
+        # recortar con él directamente hacía pasar por viva una foto fija
+        x, y, w, h = (float(value) for value in box)
+        center = np.array([x + w / 2, y + h / 2])
+        if self.center is None or np.abs(center - self.center).max() > max(self.size) / 4:
+            # Primer fotograma o desplazamiento real grande: se vuelve a centrar
+            self.center = center
+            self.size = self.size or (int(w), int(h))
+        else:
+            self.center += LIVENESS_BOX_SMOOTHING * (center - self.center)
+        return cv.getRectSubPix(gray, self.size, (float(self.center[0]), float(self.center[1])))
+    
+    def observe(self, gray, box):
+        """Pasa el rostro de un fotograma (imagen en gris y recuadro detectado) por las comprobaciones que tocan"""
+        if self.started is None:
+            self.started = time.monotonic()
+        self.frames += 1
+        face = self.crop(gray, box)
+        for check in self.checks:
+            if self.frames % self.strides[check.name]:
+                continue
+            started = time.perf_counter()
+            with metrics.span(f"liveness_{check.name}"):
+                check.observe(face)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            cost = self.costs[check.name]
+            if cost is None:
+                # La primera ejecución incluye la inicialización de OpenCV/NumPy: no cuenta
+                self.costs[check.name] = 0.0
+                continue
+            cost = elapsed_ms if not cost else cost + LIVENESS_COST_SMOOTHING * (elapsed_ms - cost)
+            self.costs[check.name] = cost
+            # Una comprobación lenta se espacia para no superar su presupuesto medio por fotograma
+            self.strides[check.name] = max(1, math.ceil(cost / check.budget_ms))
+    
+    def verdict(self):
+        """True si el rostro parece vivo, False ante una suplantación detectada, None si aún no se sabe"""
+        verdicts = [check.verdict() for check in self.checks]
+        # Solo una prueba positiva (muaré) rechaza; la falta de indicios nunca
+        if False in verdicts:
+            return False
+        if self.frames >= LIVENESS_MIN_FRAMES and True in verdicts:
+            return True
+        return None
+    
+    def expired(self):
+        """True si pasó la ventana de tiempo del intento sin un veredicto"""
+        return self.started is not None and time.monotonic() - self.started >= LIVENESS_MAX_SECONDS
+
+class RecognitionVoter:
+    """Agrega predicciones de varios fotogramas y decide en cuanto el resultado es claro"""
+    REJECTED = (-1, float('inf'))
+    SPOOFED = (-2, float('inf'))
+    
+    def __init__(self, window=VOTE_WINDOW, min_votes=VOTE_MIN, margin=VOTE_MARGIN,
+                 liveness=LIVENESS_ENABLED):
+        self.window = window
+        self.min_votes = min_votes
+        self.margin = margin
+        self.votes = deque(maxlen=window)
+        # True crea la etapa por defecto; False/None la desactiva; también acepta una LivenessStage
+        self.liveness = LivenessStage() if liveness is True else (liveness or None)
+        self.pending = None  # Decisión reconocida a la espera de la prueba de vida
+    
+        self.started = None
+        self.latency = None  # Segundos desde el primer voto hasta la decisión
+    
+    def reset(self):
+        """Descarta los votos acumulados"""
+        self.votes.clear()
+        self.pending = None
+        self.started = None
+        if self.liveness is not None:
+            self.liveness.reset()
+    
+    def observe(self, gray, box):
+        """Pasa el fotograma en gris y el recuadro del rostro a la prueba de vida"""
+        if self.liveness is not None:
+            self.liveness.observe(gray, box)
+    
+    def add(self, label, confidence):
+        """Registra una predicción; devuelve (etiqueta, confianza) al decidir, o None"""
+        if self.started is None:
+            self.started = time.perf_counter()
+        if self.pending is not None:
+            # Ya hay decisión: la predicción llegó tarde y no cuenta
+            return self.poll()
+        return self._accept(self._vote(label, confidence))
+    
+    def poll(self):
+        """Reevalúa la decisión retenida por la prueba de vida sin necesitar otra predicción"""
+        result, self.pending = self.pending, None
+        return self._accept(result)
+    
+    def _accept(self, result):
+        """Entrega una decisión de la votación si la prueba de vida lo permite"""
+        if result is not None and self.liveness is not None and result != self.REJECTED:
+            # Un reconocimiento solo se acepta si la misma ventana de fotogramas parece viva
+            alive = self.liveness.verdict()
+            if alive is None:
+                if self.liveness.expired():
+                    # Sin indicios de vida no hay suplantación probada: se repite el intento
+                    self.reset()
+                    return None
+                self.pending = result
+                return None
+            if not alive:
+                result = self.SPOOFED
+        if result is not None:
+            self.latency = time.perf_counter() - self.started
+        return result
+    
+    def _vote(self, label, confidence):
+        """Aplica las reglas de decisión sobre la ventana de votos"""
+        if confidence <= VOTE_STRONG_CONFIDENCE:
+            return label, confidence
+        
+        # Las predicciones por encima del umbral votan por "desconocido" (None)
+        self.votes.append((label if confidence <= CONFIDENCE_THRESHOLD else None, confidence))
+        ranking = Counter(vote for vote, _ in self.votes).most_common(2)
+        best, best_count = ranking[0]
+        runner_up = ranking[1][1] if len(ranking) > 1 else 0
+        
+        decisive = len(self.votes) >= self.min_votes and best_count - runner_up >= self.margin
+        if not decisive and len(self.votes) < self.window:
+            return None
+        
+        # Ventana completa sin mayoría absoluta: rechazar
+        if best is None or best_count * 2 <= len(self.votes):
+            return self.REJECTED
+        # Dos miembros casi empatados es ambiguo aunque uno tenga mayoría
+        rival = max((count for vote, count in Counter(vote for vote, _ in self.votes).items()
+                     if vote is not None and vote != best), default=0)
+        if best_count - rival < self.margin:
+            return self.REJECTED
+        return best, statistics.median(conf for vote, conf in self.votes if vote == best)
+
+class AccessLog:
+    """Registro de accesos: encola eventos y los escribe en lote desde un hilo de fondo"""
+    def __init__(self, path=ACCESS_LOG_PATH, use_sqlite=ACCESS_LOG_SQLITE):
+        self.path = path
+        self.use_sqlite = use_sqlite
+        self.events = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()  # Varias cámaras registran a la vez: un solo hilo escritor
+        self.file_day = None
+        self.conn = None
+    
+    def record(self, decision):
+        """Encola una decisión de acceso (autorizada o denegada) sin tocar el disco"""
+        latency = decision.get("latency_ms")
+        self.events.put((
+            datetime.now(),
+            decision.get("membership_id"),
+            decision.get("name"),
+            decision["status"],
+            decision.get("confidence"),
+            latency
+        ))
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._flush_loop, daemon=True)
+                self.thread.start()
+    
+    def close(self):
+        """Escribe los eventos pendientes y detiene el hilo"""
+        # Sin soltar el candado hasta que el hilo termine, nadie arranca otro mientras tanto
+        with self.lock:
+            if self.thread is not None:
+                self.events.put(None)
+                self.thread.join(timeout=5)
+                self.thread = None
+    
+    def _flush_loop(self):
+        """Agrupa los eventos que llegan durante ACCESS_LOG_FLUSH_SECONDS y los escribe"""
+        running = True
+        while running:
+            batch = [self.events.get()]
+            deadline = time.monotonic() + ACCESS_LOG_FLUSH_SECONDS
+            while batch[-1] is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.events.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                running = False
+                batch.pop()
+            if not batch:
+                continue
+            try:
+                with metrics.span("log_csv"):
+                    self._write_csv(batch)
+                if self.use_sqlite:
+                    with metrics.span("log_sqlite"):
+                        self._write_sqlite(batch)
+            except Exception as e:
+                print(f"Error al escribir el registro de accesos: {e}")
+        if self.conn is not None:
+            self.conn.close()
+    
+    def _write_csv(self, batch):
+        """Añade el lote al CSV, rotando por día o tamaño"""
+        for day, group in itertools.groupby(batch, key=lambda event: event[0].date()):
+            self._rotate_if_needed(day)
+            file_exists = os.path.isfile(self.path)
+            with open(self.path, 'a', newline='', encoding='utf-8') as file:
+                writer = csv.writer(file)
+                
+                # Escribir encabezado si el archivo está vacío o no existe
+                if not file_exists or file.tell() == 0:
+                    writer.writerow(ACCESS_LOG_HEADER)
+                
+                writer.writerows(
+                    [
+                        when.strftime("%Y-%m-%d"),
+                        when.strftime("%H:%M:%S"),
+                        membership_id or "",
+                        name or "",
+                        status,
+                        f"{score:.1f}" if score is not None and math.isfinite(score) else "",
+                        f"{latency:.0f}" if latency is not None else ""
+                    ]
+                    for when, membership_id, name, status, score, latency in group
+                )
+            self.file_day = day
+    
+    def _rotate_if_needed(self, day):
+        """Renombra el CSV actual si es de otro día, es muy grande o tiene otro formato"""
+        if not os.path.isfile(self.path):
+            return
+        old_format = False
+        if self.file_day is None:
+            self.file_day = datetime.fromtimestamp(os.path.getmtime(self.path)).date()
+            with open(self.path, newline='', encoding='utf-8') as file:
+                header = next(csv.reader(file), None)
+            old_format = header not in (None, ACCESS_LOG_HEADER)
+        
+        too_big = ACCESS_LOG_MAX_BYTES and os.path.getsize(self.path) >= ACCESS_LOG_MAX_BYTES
+        if self.file_day == day and not too_big and not old_format:
+            return
+        
+        base, ext = os.path.splitext(self.path)
+        stamp = self.file_day.strftime("%Y-%m-%d")
+        rotated = f"{base}_{stamp}{ext}"
+        counter = 1
+        while os.path.exists(rotated):
+            rotated = f"{base}_{stamp}_{counter}{ext}"
+            counter += 1
+        os.replace(self.path, rotated)
+    
+    def _write_sqlite(self, batch):
+        """Copia el lote a la tabla access_log (conexión propia del hilo de escritura)"""
+        if self.conn is None:
+            self.conn = sqlite3.connect(DB_PATH)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS access_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT NOT NULL,
+                membership_id TEXT,
+                name TEXT,
+                status TEXT NOT NULL,
+                score REAL,
+                latency_ms REAL
+            )''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_access_log_timestamp '
+                              'ON access_log (timestamp)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_access_log_member '
+                              'ON access_log (membership_id, timestamp)')
+        with self.conn:
+            self.conn.executemany(
+                'INSERT INTO access_log (timestamp, membership_id, name, status, score, latency_ms) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [
+                    (when.isoformat(sep=' ', timespec='seconds'), membership_id, name, status,
+                     score if score is not None and math.isfinite(score) else None, latency)
+                    for when, membership_id, name, status, score, latency in batch
+                ]
+            )
+
+access_log = AccessLog()
+
+def check_access(label, confidence):
+    """Decide el acceso a partir de una predicción del reconocedor"""
+    decision = {"status": "unrecognized", "label": label, "confidence": confidence}
+    if (label, confidence) == RecognitionVoter.SPOOFED:
+        decision["status"] = "spoof"
+        return decision
+    # Valores más bajos indican mejor coincidencia en LBPH
+    if confidence > CONFIDENCE_THRESHOLD:
+        return decision
+    
+    membership_id = current_model().labels.get(label)
+    decision["membership_id"] = membership_id
+    # Altas, bajas y vencimientos hechos en otro proceso sobre la misma base
+    member_repo.sync(MEMBER_SYNC_SECONDS)
+    
+    # Buscar en la caché de miembros (sin SQL en la ruta de verificación)
+    with metrics.span("member_lookup"):
+        record = member_repo.get(membership_id)
+        today, active = member_repo.access()
+    if record is None:
+        decision["status"] = "not_found"
+        return decision
+    
+    # Vigencia en O(1) desde el bitmap por etiqueta del día
+    name, exp_date = record
+    granted = label < len(active) and active[label]
+    decision.update(
+        status="granted" if granted else "expired",
+        name=name,
+        exp_date=exp_date,
+        days_left=exp_date.toordinal() - today
+    )
+    return decision
+
+# Actualizaciones incrementales y compactación en segundo plano
+_compaction = {"jobs": queue.Queue(), "pending": [], "thread": None, "lock": threading.Lock(),
+               "start_lock": threading.Lock()}
+
+def add_face_samples(member_id, faces, replaced=False):
+    """Publica una versión del modelo con las muestras de un miembro sin reentrenar el resto"""
+    label = member_repo.get_label(member_id)
+    with _model_lock:
+        _compaction["pending"].append((member_id, faces))
+        handle = current_model()
+        if handle.matcher is None:
+            # Todavía no hay modelo cargado: el entrenamiento incluirá estas muestras
+            schedule_compaction(0)
+            return
+        labels = dict(handle.labels)
+        labels[label] = member_id
+        matcher = handle.matcher.extended(faces, np.full(len(faces), label, dtype=np.int32))
+        publish_model(matcher, labels, samples_fingerprint())
+    
+    # Las muestras reemplazadas quedan obsoletas en el modelo: compactar cuanto antes.
+    # Las altas nuevas solo necesitan persistirse, así que se agrupan.
+    schedule_compaction(0 if replaced else COMPACTION_DELAY)
+
+def schedule_compaction(delay=0):
+    """Solicita un reentrenamiento completo en segundo plano"""
+    # Con dos llamadas a la vez solo una arranca el hilo que atiende la cola
+    with _compaction["start_lock"]:
+        if _compaction["thread"] is None:
+            _compaction["thread"] = threading.Thread(target=_compaction_worker, daemon=True)
+            _compaction["thread"].start()
+    _compaction["jobs"].put(delay)
+
+def _compaction_worker():
+    """Atiende las solicitudes de compactación agrupando las cercanas"""
+    while True:
+        delay = _compaction["jobs"].get()
+        while True:
+            try:
+                delay = min(delay, _compaction["jobs"].get(timeout=delay))
+            except queue.Empty:
+                break
+        try:
+            compact_model()
+        except Exception as e:
+            print(f"Error al compactar el modelo: {e}")
+
+def compact_model():
+    """Reentrena el modelo completo en una instancia nueva y la publica al terminar"""
+    # Un solo entrenamiento a la vez; las verificaciones siguen con la versión vigente
+    with _compaction["lock"], contextlib.ExitStack() as pinned:
+        with _model_lock:
+            _compaction["pending"] = []
+            fingerprint = samples_fingerprint()
+            # El archivo de datos no se borra aunque el almacén se reescriba mientras se entrena
+            layout = pinned.enter_context(sample_store.reading())
+        
+        new_recognizer = create_recognizer()
+        labels = train_recognizer(new_recognizer, layout=layout)
+        if labels:
+            save_model(labels, fingerprint, new_recognizer)
+        new_matcher = HistogramMatcher(new_recognizer)
+        
+        with _model_lock:
+            # Reaplicar las muestras añadidas mientras se entrenaba (la versión aún no es visible)
+            pending = _compaction["pending"]
+            _compaction["pending"] = []
+            # Omitir a quien ya entró en el entrenamiento con estas mismas filas
+            trained = {member_id: (start, count) for member_id, start, count in layout[2]}
+            now = {member_id: (start, count) for member_id, start, count in sample_store.layout()[2]}
+            pending = [(member_id, faces) for member_id, faces in pending
+                       if trained.get(member_id) != now.get(member_id)]
+            label_of = member_repo.get_labels([member_id for member_id, _ in pending])
+            for member_id, faces in pending:
+                labels[label_of[member_id]] = member_id
+                new_matcher.add(faces, np.full(len(faces), label_of[member_id], dtype=np.int32))
+            publish_model(new_matcher, labels, samples_fingerprint())
+
+class LatestFrame:
+    """Búfer de un solo elemento: conserva solo el dato más reciente"""
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self._seq = 0
+    
+    def put(self, item):
+        """Reemplaza el dato actual y despierta a quien espere"""
+        with self._cond:
+            self._item = item
+            self._seq += 1
+            self._cond.notify_all()
+    
+    def peek(self):
+        """Devuelve (secuencia, dato) sin esperar"""
+        with self._cond:
+            return self._seq, self._item
+    
+    def get(self, after=0, timeout=None):
+        """Espera un dato más nuevo que la secuencia `after`"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > after, timeout)
+            return self._seq, self._item
+
+class FramePipeline:
+    """Captura y detección en hilos de fondo; el hilo de Tk solo muestra el resultado"""
+    def __init__(self, cap):
+        self.cap = cap
+        self.frames = LatestFrame()      # Fotogramas crudos para el detector
+        self.detections = LatestFrame()  # Último resultado de detección
+        self.display = LatestFrame()     # Imágenes RGB listas para mostrar
+        self.tracker = FaceTracker()
+        self.running = False
+        self.threads = []
+        self.frame_times = deque(maxlen=30)  # Para calcular los FPS de la superposición
+    
+    def start(self):
+        """Arranca los hilos de captura y detección"""
+        self.running = True
+        self.threads = [
+            threading.Thread(target=self._capture_loop, daemon=True),
+            threading.Thread(target=self._detect_loop, daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+    
+    def stop(self):
+        """Detiene los hilos y libera la cámara"""
+        self.running = False
+        for thread in self.threads:
+            thread.join(timeout=1)
+        self.threads = []
+    
+    def _capture_loop(self):
+        """Lee la cámara a su velocidad nativa y prepara la vista previa"""
+        while self.running:
+            with metrics.span("camera_read"):
+                ret, frame = self.cap.read()
+            if not ret:
+                time.sleep(0.01)
+                continue
+            frame = cv.flip(frame, 1)
+            self.frames.put(frame)
+            
+            # Superponer la última detección disponible y convertir para Tk
+            with metrics.span("preview"):
+                preview = frame.copy()
+                draw_overlay(preview, self.detections.peek()[1])
+                if metrics.overlay:
+                    self.frame_times.append(time.perf_counter())
+                    draw_stats(preview, self.fps())
+                self.display.put(Image.fromarray(cv.cvtColor(preview, cv.COLOR_BGR2RGB)))
+        self.cap.release()
+    
+    def _detect_loop(self):
+        """Detecta rostros sobre el fotograma más reciente, descartando los atrasados"""
+        seq = 0
+        while self.running:
+            new_seq, frame = self.frames.get(seq, timeout=0.1)
+            if new_seq == seq:
+                continue
+            seq = new_seq
+            with metrics.span("detect"):
+                detection = detect_centered_face(frame, self.tracker)
+            self.detections.put(detection)
+        # La próxima ventana de captura reutiliza este detector ya cargado
+        release_face_cascade()
+    
+    def fps(self):
+        """Fotogramas por segundo de la cámara en los últimos fotogramas"""
+        if len(self.frame_times) < 2:
+            return 0.0
+        return (len(self.frame_times) - 1) / (self.frame_times[-1] - self.frame_times[0])
+
+class FaceTracker:
+    """Detección sobre imagen reducida con búsqueda local entre detecciones completas"""
+    def __init__(self):
+        self.last_faces = np.empty((0, 4), dtype=np.int32)
+        self.since_full = FULL_DETECT_INTERVAL
+        self.skip = 0
+        self.skipped = 0
+    
+    def detect(self, gray):
+        """Devuelve las cajas de rostro en coordenadas de la imagen completa"""
+        # Rostro quieto: reutilizar la última caja durante unos fotogramas
+        if self.skipped < self.skip:
+            self.skipped += 1
+            return self.last_faces
+        self.skipped = 0
+        
+        height, width = gray.shape[:2]
+        if self.since_full >= FULL_DETECT_INTERVAL:
+            faces = detect_faces(gray)
+            self.since_full = 0
+        else:
+            self.since_full += 1
+            if len(self.last_faces) == 1:
+                # Ventana alrededor del último rostro, con tamaños parecidos
+                x, y, w, h = self.last_faces[0]
+                margin = int(max(w, h) * TRACK_MARGIN)
+                faces = detect_faces(
+                    gray, (x - margin, y - margin, x + w + margin, y + h + margin),
+                    min_size=int(w * 0.7), max_size=int(w * 1.4)
+                )
+            else:
+                # Ventana alrededor de la guía central
+                cx, cy = width // 2, height // 2
+                faces = detect_faces(
+                    gray, (cx - GUIDE_SEARCH_HALF, cy - GUIDE_SEARCH_HALF,
+                           cx + GUIDE_SEARCH_HALF, cy + GUIDE_SEARCH_HALF)
+                )
+            if not len(faces) and len(self.last_faces):
+                # Se perdió el rostro: forzar detección completa
+                faces = detect_faces(gray)
+                self.since_full = 0
+        
+        # Omitir más fotogramas cuanto más tiempo siga quieto el rostro
+        if (len(faces) == 1 and len(self.last_faces) == 1 and
+                np.abs(faces[0] - self.last_faces[0]).max() <= STABLE_SHIFT):
+            self.skip = min(self.skip + 1, MAX_SKIP_FRAMES)
+        else:
+            self.skip = 0
+        self.last_faces = faces
+        return faces
+    
+def detect_faces(gray, region=None, min_size=30, max_size=None):
+    """Ejecuta la cascada sobre una región (o la imagen completa) reducida a DETECT_SCALE"""
+    height, width = gray.shape[:2]
+    x0, y0, x1, y1 = region if region is not None else (0, 0, width, height)
+    x0, y0 = max(0, int(x0)), max(0, int(y0))
+    x1, y1 = min(width, int(x1)), min(height, int(y1))
+    if x1 - x0 < min_size or y1 - y0 < min_size:
+        return np.empty((0, 4), dtype=np.int32)
+    
+    small = cv.resize(gray[y0:y1, x0:x1], None, fx=DETECT_SCALE, fy=DETECT_SCALE,
+                      interpolation=cv.INTER_AREA)
+    scaled_min = max(int(min_size * DETECT_SCALE), 20)
+    scaled_max = (int(max_size * DETECT_SCALE),) * 2 if max_size else None
+    faces = get_face_cascade().detectMultiScale(
+        small, scaleFactor=1.1, minNeighbors=5,
+        minSize=(scaled_min, scaled_min), maxSize=scaled_max
+    )
+    if not len(faces):
+        return np.empty((0, 4), dtype=np.int32)
+    faces = (np.asarray(faces) / DETECT_SCALE).astype(np.int32)
+    faces[:, 0] += x0
+    faces[:, 1] += y0
+    return faces
+
+def detect_centered_face(frame, tracker=None):
+    """Detecta rostros y extrae el ROI normalizado si hay uno solo centrado"""
+    gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+    center_x, center_y = frame.shape[1]//2, frame.shape[0]//2
+    
+    if tracker is not None:
+        faces = tracker.detect(gray)
+    else:
+        faces = get_face_cascade().detectMultiScale(
+            gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30)
+        )
+    
+    roi = box = None
+    for (x, y, w, h) in faces:
+        # Verificar si el rostro está centrado
+        if (abs(x + w/2 - center_x) < 50 and 
+            abs(y + h/2 - center_y) < 50 and
+            len(faces) == 1):
+            face = gray[y:y+h, x:x+w]
+            roi = preprocess_face(face)
+            box = (x, y, w, h)
+    # La imagen sin ecualizar y el recuadro alimentan la prueba de vida, que recorta por su cuenta
+    return {"faces": faces, "roi": roi, "gray": gray, "box": box}
+
+def draw_overlay(frame, detection):
+    """Dibuja la guía de posicionamiento y los rostros detectados"""
+    center_x, center_y = frame.shape[1]//2, frame.shape[0]//2
+    cv.rectangle(frame, (center_x-100, center_y-100), 
+                (center_x+100, center_y+100), (255,255,255), 2)
+    if detection is not None:
+        for (x, y, w, h) in detection["faces"]:
+            cv.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
+
+def draw_stats(frame, fps):
+    """Escribe los FPS y la latencia reciente de las etapas principales sobre el fotograma"""
+    lines = [f"{fps:.1f} FPS"]
+    for stage in ("detect", "predict", "photoimage"):
+        latency = metrics.recent_ms(stage)
+        if latency is not None:
+            lines.append(f"{stage} {latency:.1f} ms")
+    for row, text in enumerate(lines):
+        cv.putText(frame, text, (8, 18 + 18 * row), cv.FONT_HERSHEY_SIMPLEX, 0.5,
+                   (0, 255, 255), 1, cv.LINE_AA)
+
+class RecognitionEngine:
+    """Ruta de verificación sin interfaz: preprocesado, predicción, miembro, expiración y registro"""
+    def __init__(self, log=access_log):
+        self.log = log
+    
+    def decide(self, label, confidence, latency_ms=None, log=True):
+        """Convierte una predicción en una decisión de acceso y la registra"""
+        decision = check_access(label, confidence)
+        if latency_ms is not None:
+            decision["latency_ms"] = latency_ms
+            if metrics.enabled:
+                metrics.observe("verification", latency_ms / 1000)
+        if log:
+            self.log.record(decision)
+        return decision
+    
+    def verify_roi(self, roi, normalized=False):
+        """Verifica un recorte de rostro"""
+        if not current_model().labels:
+            raise RuntimeError("No hay miembros registrados")
+        started = time.perf_counter()
+        if not normalized:
+            with metrics.span("preprocess"):
+                roi = preprocess_face(roi)
+        label, confidence = predict_face(roi)
+        return self.decide(label, confidence, (time.perf_counter() - started) * 1000)
+    
+    def verify_frame(self, gray):
+        """Verifica el rostro más grande de un fotograma completo"""
+        faces = detect_faces(gray)
+        if not len(faces):
+            return {"status": "no_face"}
+        x, y, w, h = max(faces, key=lambda f: f[2] * f[3])
+        return self.verify_roi(gray[y:y+h, x:x+w])
+    
+    def verify_image(self, data, is_roi=False):
+        """Verifica una imagen JPEG/PNG codificada (fotograma completo o recorte)"""
+        image = cv.imdecode(np.frombuffer(data, dtype=np.uint8), cv.IMREAD_GRAYSCALE)
+        if image is None:
+            raise ValueError("Imagen no válida")
+        return self.verify_roi(image) if is_roi else self.verify_frame(image)
+
+engine = RecognitionEngine()
+
+def decision_to_json(decision):
+    """Convierte una decisión en un dict serializable en JSON"""
+    result = {}
+    for key, value in decision.items():
+        if isinstance(value, date):
+            value = value.isoformat()
+        elif isinstance(value, np.generic):
+            value = value.item()
+        if isinstance(value, float) and not math.isfinite(value):
+            value = None
+        result[key] = value
+    return result
+
+class VerificationServer:
+    """Servicio HTTP local (asyncio) que comparte un único modelo entre varios terminales
+    
+    POST /verify       cuerpo: imagen JPEG/PNG de un fotograma completo
+    POST /verify?roi=1 cuerpo: imagen de un rostro ya recortado
+    GET  /health       estado del servicio y miembros cargados
+    """
+    REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found",
+               413: "Payload Too Large", 503: "Service Unavailable"}
+    
+    def __init__(self, engine, host=SERVER_HOST, port=SERVER_PORT, unix_path=None):
+        self.engine = engine
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+        # Un único hilo de reconocimiento: el modelo y la cascada no se comparten entre hilos
+        self.executor = ThreadPoolExecutor(max_workers=1)
+    
+    def run(self):
+        """Sirve peticiones hasta interrumpir el proceso"""
+        try:
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.executor.shutdown(wait=False)
+    
+    async def _serve(self):
+        """Abre el socket TCP o Unix y mantiene el modelo al día"""
+        if self.unix_path:
+            server = await asyncio.start_unix_server(self._handle, path=self.unix_path)
+            print(f"Servicio de verificación en {self.unix_path}")
+        else:
+            server = await asyncio.start_server(self._handle, self.host, self.port)
+            print(f"Servicio de verificación en http://{self.host}:{self.port}")
+        # Terminar ordenadamente con Ctrl+C o SIGTERM (donde el sistema lo permita)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+        async with server:
+            reload_task = asyncio.create_task(self._reload_model())
+            await stop.wait()
+            reload_task.cancel()
+    
+    async def _reload_model(self):
+        """Recarga el modelo si otro proceso cambió las muestras"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(MODEL_RELOAD_SECONDS)
+            try:
+                # Fuera del ejecutor de verificación: se sigue respondiendo con la versión vigente
+                await loop.run_in_executor(None, ensure_model)
+                await loop.run_in_executor(None, member_repo.sync)
+            except Exception as e:
+                print(f"Error al recargar el modelo: {e}")
+    
+    async def _handle(self, reader, writer):
+        """Atiende una conexión HTTP/1.1 (con keep-alive)"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                
+                length = int(headers.get('content-length', 0))
+                if length > SERVER_MAX_UPLOAD:
+                    await self._respond(writer, 413, {"error": "Imagen demasiado grande"}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                
+                status, payload = await self._dispatch(method, target, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # Conexión inactiva cerrada al detener el servicio
+            pass
+        finally:
+            writer.close()
+    
+    async def _dispatch(self, method, target, body):
+        """Enruta la petición y devuelve (código HTTP, cuerpo JSON o texto)"""
+        path, _, query = target.partition('?')
+        params = urllib.parse.parse_qs(query)
+        if method == 'GET' and path == '/health':
+            handle = current_model()
+            return 200, {"status": "ok", "members": len(handle.labels), "model_version": handle.version}
+        if method == 'GET' and path == '/metrics':
+            return 200, metrics.prometheus()
+        if method == 'POST' and path == '/verify':
+            is_roi = params.get('roi', ['0'])[0].lower() in ('1', 'true', 'yes')
+            loop = asyncio.get_running_loop()
+            try:
+                decision = await loop.run_in_executor(
+                    self.executor, self.engine.verify_image, body, is_roi
+                )
+            except ValueError as e:
+                return 400, {"error": str(e)}
+            except RuntimeError as e:
+                return 503, {"error": str(e)}
+            return 200, decision_to_json(decision)
+        return 404, {"error": "Ruta no encontrada"}
+    
+    async def _respond(self, writer, status, payload, keep_alive):
+        """Escribe una respuesta JSON (o de texto, como las métricas para Prometheus)"""
+        if isinstance(payload, str):
+            body = payload.encode('utf-8')
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            content_type = "application/json; charset=utf-8"
+        head = (
+            f"HTTP/1.1 {status} {self.REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
 
-# Constantes
-DB_PATH = 'members.db'
-SAMPLES_DIR = 'face_samples'
-DARK_BG = "#1E1E1E"
-LIGHT_BG = "#2D2D30"
-ACCENT_COLOR = "#0078D7"
-TEXT_COLOR = "#FFFFFF"
+# Fuentes de video y varias cámaras
+def open_video_source(source):
+    """Abre una fuente de video: índice de cámara, archivo, URL (RTSP/HTTP) o carpeta de imágenes"""
+    source = str(source)
+    if source.isdigit():
+        # DirectShow solo existe en Windows
+        if os.name == 'nt':
+            return cv.VideoCapture(int(source), cv.CAP_DSHOW)
+        return cv.VideoCapture(int(source))
+    if os.path.isdir(source):
+        return ImageFolderCapture(source)
+    return cv.VideoCapture(source)
 
-# Inicialización del detector y reconocedor facial
-try:
-    CASC_PATH = cv.data.haarcascades + 'haarcascade_frontalface_default.xml'
-except AttributeError:
-    CASC_PATH = 'haarcascade_frontalface_default.xml'
-face_cascade = cv.CascadeClassifier(CASC_PATH)
-recognizer = cv.face.LBPHFaceRecognizer_create()
+def is_live_source(source):
+    """Indica si la fuente es una cámara o un flujo en vivo (no un archivo grabado)"""
+    source = str(source)
+    return source.isdigit() or '://' in source
 
-# Funciones de preparación
-def ensure_dirs():
-    """Crea directorios necesarios"""
-    if not os.path.exists(SAMPLES_DIR):
-        os.makedirs(SAMPLES_DIR)
+class ImageFolderCapture:
+    """Imita cv.VideoCapture leyendo en orden las imágenes de una carpeta"""
+    def __init__(self, path):
+        self.paths = [
+            os.path.join(path, f) for f in sorted(os.listdir(path))
+            if f.lower().endswith(SAMPLE_EXTS[1:])
+        ]
+        self.index = 0
+    
+    def isOpened(self):
+        return bool(self.paths)
+    
+    def read(self):
+        while self.index < len(self.paths):
+            frame = cv.imread(self.paths[self.index])
+            self.index += 1
+            if frame is not None:
+                return True, frame
+        return False, None
+    
+    def get(self, prop):
+        return MULTICAM_FOLDER_FPS if prop == cv.CAP_PROP_FPS else 0
+    
+    def release(self):
+        pass
 
-def init_db():
-    """Inicializa la base de datos"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS members (
-        membership_id TEXT PRIMARY KEY,
-        name TEXT NOT NULL,
-        expiration_date TEXT NOT NULL
-    )''')
-    conn.commit()
-    conn.close()
-    ensure_dirs()
+class RepeatFilter:
+    """Descarta decisiones repetidas de la misma persona durante unos segundos"""
+    def __init__(self):
+        self.last_seen = {}
+    
+    def accept(self, decision):
+        """True si la decisión debe mostrarse/registrarse"""
+        key = decision.get("membership_id") or decision["status"]
+        debounce = (KIOSK_DEBOUNCE_SECONDS if decision["status"] == "granted"
+                    else KIOSK_RESULT_SECONDS)
+        now = time.monotonic()
+        if now - self.last_seen.get(key, -debounce) < debounce:
+            return False
+        self.last_seen[key] = now
+        return True
 
-def train_recognizer():
-    """Entrena el reconocedor facial"""
-    images = [os.path.join(SAMPLES_DIR, f) for f in os.listdir(SAMPLES_DIR) 
-             if f.lower().endswith(('.png','.jpg','.jpeg'))]
-    ids = []
-    faces = []
-    labels = []
+# Estado de cada proceso del grupo de reconocimiento
+_worker_model = {"path": None, "matcher": None, "mtime": None, "checked": 0.0}
+
+def _pool_init(model_path):
+    """Carga el modelo persistido en un proceso del grupo"""
+    _worker_model["path"] = model_path
+    _pool_reload()
+
+def _pool_reload():
+    """Vuelve a leer el modelo si el archivo cambió"""
+    _worker_model["checked"] = time.monotonic()
+    mtime = os.path.getmtime(_worker_model["path"])
+    if mtime != _worker_model["mtime"]:
+        model = create_recognizer()
+        model.read(_worker_model["path"])
+        _worker_model["matcher"] = HistogramMatcher(model)
+        _worker_model["mtime"] = mtime
+
+def _pool_warmup():
+    """Primera predicción de un proceso recién creado (asigna memoria y carga código)"""
+    return _pool_predict(np.zeros(FACE_SIZE[::-1], dtype=np.uint8))
+
+def _pool_predict(roi):
+    """Predicción dentro de un proceso del grupo"""
+    if time.monotonic() - _worker_model["checked"] > MODEL_RELOAD_SECONDS:
+        _pool_reload()
+    return _worker_model["matcher"].predict(roi)
+
+class CameraWorker:
+    """Captura y detección de una entrada en su propio hilo; el reconocimiento va al grupo"""
+    def __init__(self, name, source, pool, realtime=True):
+        self.name = name
+        self.source = source
+        self.pool = pool
+        self.realtime = realtime
+        self.tracker = FaceTracker()
+        self.voter = RecognitionVoter()
+        self.repeats = RepeatFilter()
+        self.inflight = deque()  # (futuro, instante de envío, sesión)
+        self.latencies = deque(maxlen=1000)
+        self.frames = 0
+        self.dropped = 0
+        self.decisions = 0
+        self.session = 0
+        self.decided = False
+        self.running = False
+        self.finished = False
+        self.ended = None
+    
+    def start(self):
+        """Abre la fuente y arranca el hilo de la cámara"""
+        self.cap = open_video_source(self.source)
+        if not self.cap.isOpened():
+            raise RuntimeError(f"No se pudo abrir la fuente de video {self.source}")
+        self.live = is_live_source(self.source)
+        fps = self.cap.get(cv.CAP_PROP_FPS) or 0
+        # Los archivos grabados se reproducen a su velocidad real para simular una cámara
+        self.frame_interval = 1 / fps if self.realtime and not self.live and fps > 0 else 0
+        self.started = time.perf_counter()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        """Detiene el hilo de la cámara"""
+        self.running = False
+        self.thread.join(timeout=5)
+    
+    def _run(self):
+        """Ejecuta el bucle de la cámara y marca su fin aunque falle"""
+        try:
+            self._loop()
+        except Exception as e:
+            print(f"[{self.name}] Error en la cámara: {e}")
+        finally:
+            self.cap.release()
+            self.running = False
+            self.ended = time.perf_counter()
+            self.finished = True
+    
+    def _loop(self):
+        """Lee, detecta y envía rostros estables al grupo de reconocimiento"""
+        next_frame = time.perf_counter()
+        stable = 0
+        while self.running:
+            ret, frame = self.cap.read()
+            if not ret:
+                if self.live:
+                    time.sleep(0.01)
+                    continue
+                break
+            self.frames += 1
+            self._collect()
+            
+            detection = detect_centered_face(frame, self.tracker)
+            if detection["roi"] is None:
+                # La persona se fue: los resultados pendientes ya no cuentan
+                stable = 0
+                self.decided = False
+                self.session += 1
+                self.voter.reset()
+            else:
+                self.voter.observe(detection["gray"], detection["box"])
+                stable += 1
+                if stable >= KIOSK_STABLE_FRAMES and not self.decided:
+                    if self.voter.pending is not None:
+                        # Decisión retenida por la prueba de vida: no hacen falta más predicciones
+                        prediction = self.voter.poll()
+                        if prediction is not None:
+                            self._decide(prediction)
+                    elif len(self.inflight) < MULTICAM_MAX_INFLIGHT:
+                        future = self.pool.submit(_pool_predict, detection["roi"])
+                        self.inflight.append((future, time.perf_counter(), self.session))
+                    else:
+                        self.dropped += 1
+            
+            if self.frame_interval:
+                next_frame += self.frame_interval
+                delay = next_frame - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        
+        # Esperar las predicciones pendientes antes de terminar
+        for future, _, _ in self.inflight:
+            future.exception()
+        self._collect()
+    
+    def _collect(self):
+        """Procesa en orden las predicciones ya terminadas"""
+        while self.inflight and self.inflight[0][0].done():
+            future, submitted, session = self.inflight.popleft()
+            self.latencies.append((time.perf_counter() - submitted) * 1000)
+            try:
+                label, confidence = future.result()
+            except Exception as e:
+                print(f"[{self.name}] Error durante la verificación: {e}")
+                continue
+            if session != self.session or self.decided:
+                continue
+            prediction = self.voter.add(label, confidence)
+            if prediction is not None:
+                self._decide(prediction)
+    
+    def _decide(self, prediction):
+        """Convierte la decisión del votador en un acceso y lo registra si no es repetido"""
+        decision = engine.decide(*prediction, latency_ms=self.voter.latency * 1000, log=False)
+        self.voter.reset()
+        self.decided = decision["status"] != "unrecognized"
+        if self.repeats.accept(decision):
+            self.decisions += 1
+            engine.log.record(decision)
+            print(f"[{self.name}] {decision['status']}: "
+                  f"{decision.get('name') or decision.get('membership_id') or '-'}")
+    
+    def stats(self):
+        """Métricas de la cámara: fps, cola, latencia y decisiones"""
+        elapsed = max((self.ended or time.perf_counter()) - self.started, 1e-9)
+        latencies = sorted(self.latencies)
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 1) \
+                if latencies else None
+        return {
+            "camera": self.name,
+            "source": str(self.source),
+            "frames": self.frames,
+            "fps": round(self.frames / elapsed, 1),
+            "queue_depth": len(self.inflight),
+            "dropped": self.dropped,
+            "decisions": self.decisions,
+            "latency_p50_ms": percentile(0.50),
+            "latency_p95_ms": percentile(0.95),
+        }
+
+class MultiCameraMonitor:
+    """Varias entradas, cada una con su hilo, compartiendo un grupo de procesos de reconocimiento"""
+    def __init__(self, sources, workers=None, realtime=True):
+        self.sources = sources
+        self.workers = workers
+        self.realtime = realtime
+    
+    def run(self, duration=None):
+        """Procesa las fuentes hasta que terminen (o hasta `duration` segundos)"""
+        if not ensure_model():
+            raise RuntimeError("No hay miembros registrados")
+        # 'spawn' evita duplicar con fork un proceso que ya tiene hilos en marcha
+        workers = self.workers or os.cpu_count() or 1
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_pool_init,
+            initargs=(os.path.abspath(model_path()),)
+        )
+        # Arrancar todos los procesos antes de abrir las cámaras
+        for future in [pool.submit(_pool_warmup) for _ in range(workers)]:
+            future.result()
+        cameras = [CameraWorker(f"cam{i}", source, pool, self.realtime)
+                   for i, source in enumerate(self.sources)]
+        try:
+            for camera in cameras:
+                camera.start()
+            started = time.monotonic()
+            next_report = started + MULTICAM_REPORT_SECONDS
+            next_reload = started + MODEL_RELOAD_SECONDS
+            while not all(camera.finished for camera in cameras):
+                if duration is not None and time.monotonic() - started >= duration:
+                    break
+                time.sleep(0.1)
+                if time.monotonic() >= next_reload:
+                    # Los procesos del grupo releen el modelo solos; aquí el mapa de etiquetas y los miembros
+                    try:
+                        ensure_model(block=False)
+                        member_repo.sync()
+                    except Exception as e:
+                        print(f"Error al recargar el modelo: {e}")
+                    next_reload += MODEL_RELOAD_SECONDS
+                if time.monotonic() >= next_report:
+                    self.report(cameras)
+                    next_report += MULTICAM_REPORT_SECONDS
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for camera in cameras:
+                if camera.running:
+                    camera.stop()
+            pool.shutdown()
+        self.report(cameras)
+        return [camera.stats() for camera in cameras]
+    
+    @staticmethod
+    def report(cameras):
+        """Imprime profundidad de cola y latencia por cámara"""
+        for camera in cameras:
+            st = camera.stats()
+            print(f"{st['camera']} ({st['source']}): {st['fps']} fps | "
+                  f"en cola {st['queue_depth']} | descartados {st['dropped']} | "
+                  f"p50 {st['latency_p50_ms']} ms | p95 {st['latency_p95_ms']} ms | "
+                  f"decisiones {st['decisions']}")
+
+# Altas masivas desde CSV y fotos, y traslado de la instalación a otro equipo
+def read_members_csv(path):
+    """Lee un CSV con columnas membership_id, name, expiration_date (y photo opcional)
+    
+    Devuelve (filas válidas, errores por línea).
+    """
+    rows, errors, seen = [], [], set()
+    with open(path, newline='', encoding='utf-8-sig') as file:
+        # Los valores sobrantes de una fila van a una lista aparte en lugar de a la clave None
+        extra = object()
+        reader = csv.DictReader(file, restkey=extra)
+        fields = {field.strip().lower(): field for field in reader.fieldnames or []}
+        missing = {"membership_id", "name", "expiration_date"} - fields.keys()
+        if missing:
+            raise ValueError(f"Faltan columnas en el CSV: {', '.join(sorted(missing))}")
+        for line, record in enumerate(reader, start=2):
+            if extra in record:
+                errors.append((line, f"{len(record[extra])} columnas de más"))
+                continue
+            value = lambda key: (record.get(fields[key]) or "").strip() if key in fields else ""
+            member_id, name, exp_str = value("membership_id"), value("name"), value("expiration_date")
+            if not (member_id and name and exp_str):
+                errors.append((line, "faltan datos"))
+                continue
+            try:
+                datetime.strptime(exp_str, "%Y-%m-%d")
+            except ValueError:
+                errors.append((line, f"fecha no válida: {exp_str}"))
+                continue
+            if member_id in seen:
+                errors.append((line, f"ID repetido: {member_id}"))
+                continue
+            seen.add(member_id)
+            photos = [photo.strip() for photo in value("photo").split(';') if photo.strip()]
+            rows.append((member_id, name, exp_str, photos))
+    return rows, errors
+
+def photo_index(directory):
+    """Fotos de cada miembro en una carpeta: ID.jpg o una subcarpeta ID/ con varias"""
+    index = {}
+    for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+        if entry.is_dir():
+            photos = sorted(os.path.join(entry.path, f) for f in os.listdir(entry.path)
+                            if f.lower().endswith(PHOTO_EXTS))
+            if photos:
+                index.setdefault(entry.name, []).extend(photos)
+        elif entry.name.lower().endswith(PHOTO_EXTS):
+            index.setdefault(os.path.splitext(entry.name)[0], []).append(entry.path)
+    return index
+
+def enrollment_face(path):
+    """Rostro normalizado más grande de una foto, o None si no se encontró ninguno"""
+    # imdecode en lugar de imread: admite rutas con acentos en Windows
+    img = cv.imdecode(np.fromfile(path, dtype=np.uint8), cv.IMREAD_GRAYSCALE)
+    if img is None:
+        raise ValueError("imagen no válida")
+    scale = ENROLL_MAX_SIDE / max(img.shape)
+    if scale < 1:
+        img = cv.resize(img, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA)
+    faces = detect_faces(img)
+    if not len(faces):
+        return None
+    x, y, w, h = max(faces, key=lambda f: f[2] * f[3])
+    return preprocess_face(img[y:y+h, x:x+w])
+
+def _enroll_chunk(tasks):
+    """Detecta y normaliza los rostros de varios miembros (se ejecuta en un proceso del grupo)"""
+    results = []
+    for member_id, paths in tasks:
+        faces, problems = [], []
+        for path in paths:
+            try:
+                face = enrollment_face(path)
+            except (OSError, ValueError) as e:
+                problems.append(f"{os.path.basename(path)}: {e}")
+                continue
+            if face is None:
+                problems.append(f"{os.path.basename(path)}: no se detectó ningún rostro")
+            else:
+                faces.append(face)
+        results.append((member_id, np.stack(faces) if faces else None, problems))
+    return results
+
+def enroll_photos(photos, workers=TRAIN_WORKERS, progress=None):
+    """Rostros normalizados por miembro a partir de {membership_id: [fotos]}, en paralelo"""
+    items = list(photos.items())
+    tasks = [items[i:i + ENROLL_CHUNK] for i in range(0, len(items), ENROLL_CHUNK)]
+    faces, problems, done = {}, [], 0
+    
+    def store(results):
+        nonlocal done
+        for member_id, stack, member_problems in results:
+            if stack is not None:
+                faces[member_id] = stack
+            problems.extend((member_id, problem) for problem in member_problems)
+        done += len(results)
+        if progress is not None:
+            progress(done, len(items))
+    
+    if len(items) < ENROLL_PARALLEL_MIN or workers == 1:
+        for task in tasks:
+            store(_enroll_chunk(task))
+    else:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            for future in as_completed([pool.submit(_enroll_chunk, task) for task in tasks]):
+                store(future.result())
+    return faces, problems
+
+def import_members(csv_path, photos_dir=None, workers=TRAIN_WORKERS, progress=None):
+    """Alta masiva: miembros en una transacción, rostros en paralelo y un solo entrenamiento"""
+    rows, errors = read_members_csv(csv_path)
     
-    for idx, img_path in enumerate(images):
-        img = cv.imread(img_path, cv.IMREAD_GRAYSCALE)
-        if img is None:
-            continue
-        faces.append(img)
-        labels.append(idx)
-        member_id = os.path.splitext(os.path.basename(img_path))[0]
-        ids.append(member_id)
+    # Fotos de la columna photo (relativas a la carpeta de fotos o al CSV) o por ID
+    base = photos_dir or os.path.dirname(os.path.abspath(csv_path))
+    found = photo_index(photos_dir) if photos_dir else {}
+    photos = {}
+    for member_id, _, _, listed in rows:
+        paths = [os.path.join(base, photo) for photo in listed] or found.get(member_id, [])
+        if paths:
+            photos[member_id] = paths
+    faces, problems = enroll_photos(
+        photos, workers, progress and (lambda done, total: progress("rostros", done, total))
+    )
     
+    member_repo.add_many([(member_id, name, exp_str) for member_id, name, exp_str, _ in rows])
+    sample_store.put_many(faces.items())
+    labels = {}
     if faces:
-        recognizer.train(faces, np.array(labels))
-    return ids
+        labels = rebuild_model(
+            workers, progress and (lambda done, total: progress("modelo", done, total))
+        )
+    return {
+        "members": len(rows),
+        "with_faces": len(faces),
+        "without_face": [member_id for member_id, *_ in rows if member_id not in faces],
+        "errors": errors,
+        "problems": problems,
+        "trained": len(labels),
+    }
+
+def _extract_member(archive, name, target):
+    """Copia un miembro del .zip a un archivo temporal y lo coloca de forma atómica"""
+    tmp_path = target + '.tmp'
+    with archive.open(name) as source, open(tmp_path, 'wb') as file:
+        shutil.copyfileobj(source, file, 1024 * 1024)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, target)
+
+def export_archive(path):
+    """Empaqueta miembros, etiquetas, muestras y modelo en un .zip para otro equipo"""
+    tmp_path = path + '.tmp'
+    # Mientras se copia no cambian ni el almacén ni el modelo publicado
+    with _model_lock, sample_store.lock:
+        data_name, index_path = sample_store.files()
+        members = io.StringIO()
+        writer = csv.writer(members)
+        writer.writerow(["membership_id", "name", "expiration_date"])
+        writer.writerows((member_id, name, exp_date.isoformat())
+                         for member_id, name, exp_date in sorted(member_repo.all()))
+        labels = io.StringIO()
+        csv.writer(labels).writerows([("label", "membership_id")] + member_repo.label_rows())
+        model_files = [name for name in (model_path(), MODEL_META_PATH) if os.path.isfile(name)]
+        manifest = {
+            "format": ARCHIVE_FORMAT,
+            "created": datetime.now().isoformat(timespec='seconds'),
+            "preprocess_version": PREPROCESS_VERSION,
+            "backend": recognizer_backend(),
+            "members": member_repo.count(),
+            "samples": {"index": os.path.basename(index_path), "data": data_name},
+            "model": model_files,
+        }
+        
+        with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("manifest.json", json.dumps(manifest, indent=2))
+            archive.writestr("members.csv", members.getvalue())
+            archive.writestr("face_labels.csv", labels.getvalue())
+            # Muestras y modelo sin comprimir: son grandes y casi no se reducen
+            if os.path.isfile(index_path):
+                archive.write(index_path, f"samples/{manifest['samples']['index']}")
+            if data_name:
+                archive.write(sample_store.data_path(data_name), f"samples/{data_name}",
+                              compress_type=zipfile.ZIP_STORED)
+            for name in model_files:
+                archive.write(name, f"model/{os.path.basename(name)}", compress_type=zipfile.ZIP_STORED)
+    os.replace(tmp_path, path)
+    return manifest
+
+def import_archive(path):
+    """Restaura en una instalación vacía un .zip creado con export-archive"""
+    if member_repo.count() or len(sample_store):
+        raise RuntimeError("La instalación ya tiene miembros; use import-members o "
+                           "import-samples para combinar datos")
+    with zipfile.ZipFile(path) as archive:
+        manifest = json.loads(archive.read("manifest.json"))
+        if manifest.get("format") != ARCHIVE_FORMAT:
+            raise ValueError(f"Formato de archivo no compatible: {manifest.get('format')}")
+        data_name = manifest["samples"]["data"]
+        model_files = manifest["model"]
+        # Solo nombres conocidos: un .zip manipulado no puede escribir fuera del directorio
+        if (data_name and os.path.basename(data_name) != data_name or
+                not set(model_files) <= {MODEL_PATH, NUMPY_MODEL_PATH, MODEL_META_PATH}):
+            raise ValueError("Archivo con rutas no válidas")
+        
+        with io.TextIOWrapper(archive.open("members.csv"), encoding='utf-8', newline='') as file:
+            member_repo.add_many([tuple(row) for row in itertools.islice(csv.reader(file), 1, None)])
+        with io.TextIOWrapper(archive.open("face_labels.csv"), encoding='utf-8', newline='') as file:
+            member_repo.restore_labels([(int(label), member_id) for label, member_id
+                                        in itertools.islice(csv.reader(file), 1, None)])
+        
+        # Datos antes que el índice, como en SampleStore.put; con la misma huella no se reentrena
+        with sample_store.lock:
+            if data_name:
+                _extract_member(archive, f"samples/{data_name}", sample_store.data_path(data_name))
+            _extract_member(archive, f"samples/{manifest['samples']['index']}", sample_store.path)
+        with _model_lock:
+            for name in model_files:
+                _extract_member(archive, f"model/{os.path.basename(name)}", name)
+    return manifest
+
+# Banco de pruebas de rendimiento con datos sintéticos
+def synthetic_faces(member_index, count, rng):
+    """Muestras sintéticas de un miembro: un patrón suave propio con ruido y brillo variables"""
+    pattern = np.random.default_rng(member_index).integers(0, 256, (25, 25), dtype=np.uint8)
+    base = cv.resize(pattern, FACE_SIZE, interpolation=cv.INTER_CUBIC).astype(np.int16)
+    faces = []
+    for _ in range(count):
+        noisy = base + rng.integers(-12, 13, base.shape) + int(rng.integers(-20, 21))
+        faces.append(preprocess_face(np.clip(noisy, 0, 255).astype(np.uint8)))
+    return np.stack(faces)
+
+def latency_summary(values):
+    """Percentiles (ms) de una lista de duraciones en segundos"""
+    if not len(values):
+        return None
+    ms = np.asarray(values) * 1000
+    return {
+        "p50": round(float(np.percentile(ms, 50)), 3),
+        "p95": round(float(np.percentile(ms, 95)), 3),
+        "p99": round(float(np.percentile(ms, 99)), 3),
+        "mean": round(float(ms.mean()), 3)
+    }
+
+def memory_usage_mb():
+    """Memoria residente actual y máxima del proceso en MB (None si no se puede medir)"""
+    current = peak = None
+    try:
+        with open('/proc/self/statm') as file:
+            current = int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        # ru_maxrss está en KB en Linux y en bytes en macOS
+        scale = 2**20 if platform.system() == 'Darwin' else 2**10
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    return (round(current, 1) if current is not None else None,
+            round(peak, 1) if peak is not None else None)
+
+def source_revision():
+    """Commit de git del script, para comparar resultados entre versiones"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+class Benchmark:
+    """Mide entrenamiento, predicción, preprocesado y detección en un directorio temporal"""
+    def __init__(self, members=BENCH_MEMBERS, samples=SAMPLES_PER_MEMBER, queries=BENCH_QUERIES,
+                 video=None, frames=BENCH_FRAMES, workers=TRAIN_WORKERS, seed=0):
+        self.members = sorted(members)
+        self.samples = samples
+        self.queries = queries
+        self.video = video
+        self.frames = frames
+        self.workers = workers
+        self.rng = np.random.default_rng(seed)
+    
+    def run(self, workdir=None):
+        """Ejecuta todas las mediciones y devuelve un diccionario serializable en JSON"""
+        # Los datos sintéticos viven en su propio directorio: no se toca la BD ni el modelo reales
+        video = os.path.abspath(self.video) if self.video else None
+        keep = workdir is not None
+        workdir = workdir or tempfile.mkdtemp(prefix='gymaccess-bench-')
+        os.makedirs(workdir, exist_ok=True)
+        previous = os.getcwd()
+        os.chdir(workdir)
+        try:
+            init_db()
+            results = {
+                "meta": {
+                    "revision": source_revision(),
+                    "timestamp": datetime.now().isoformat(timespec='seconds'),
+                    "python": platform.python_version(),
+                    "numpy": np.__version__,
+                    "opencv": cv.__version__,
+                    "backend": recognizer_backend(),
+                    "cpus": os.cpu_count(),
+                    "face_size": list(FACE_SIZE),
+                    "samples_per_member": self.samples
+                },
+                "preprocess_ms": self.bench_preprocess(),
+                "sizes": [self.bench_size(count) for count in self.members],
+                "backends": self.bench_backends(),
+                "detection": self.bench_detection(video) if video else None
+            }
+        finally:
+            member_repo.close()
+            os.chdir(previous)
+            if not keep:
+                shutil.rmtree(workdir, ignore_errors=True)
+        return results
+    
+    def bench_preprocess(self):
+        """Normalización de recortes de rostro de tamaño típico"""
+        crops = [self.rng.integers(0, 256, (180, 180), dtype=np.uint8) for _ in range(100)]
+        timings = []
+        for crop in crops:
+            started = time.perf_counter()
+            preprocess_face(crop)
+            timings.append(time.perf_counter() - started)
+        return latency_summary(timings)
+    
+    def bench_size(self, count):
+        """Amplía el almacén hasta `count` miembros y mide entrenamiento y predicción"""
+        present = len(sample_store)
+        started = time.perf_counter()
+        new_members = ((f"B{i}", synthetic_faces(i, self.samples, self.rng))
+                       for i in range(present, count))
+        sample_store.rewrite(itertools.chain(sample_store.items(), new_members))
+        dataset_s = time.perf_counter() - started
+        
+        model = create_recognizer()
+        started = time.perf_counter()
+        labels = train_recognizer(model, self.workers)
+        train_s = time.perf_counter() - started
+        
+        fingerprint = samples_fingerprint()
+        started = time.perf_counter()
+        save_model(labels, fingerprint, model)
+        save_s = time.perf_counter() - started
+        started = time.perf_counter()
+        model, labels = load_model(fingerprint)
+        matcher = HistogramMatcher(model)
+        load_s = time.perf_counter() - started
+        handle = publish_model(matcher, labels, fingerprint)
+        
+        # Consultas: variaciones nuevas de miembros al azar
+        targets = self.rng.integers(0, count, self.queries)
+        queries = [synthetic_faces(int(i), 1, self.rng)[0] for i in targets]
+        label_of = member_repo.get_labels([f"B{i}" for i in range(count)])
+        timings, correct, agree = [], 0, 0
+        for target, query in zip(targets, queries):
+            started = time.perf_counter()
+            label, _ = handle.predict(query)
+            timings.append(time.perf_counter() - started)
+            correct += label == label_of[f"B{target}"]
+            # Efecto de la preselección: coincidencia con la búsqueda exacta sobre todas las filas
+            distances = chi_square_distances(matcher.histograms, matcher.sums,
+                                             matcher.histogram(query).astype(np.float64))
+            agree += label == matcher.labels[int(np.argmin(distances))]
+        
+        rss, peak = memory_usage_mb()
+        model_bytes = matcher.histograms.nbytes + matcher.projected.nbytes
+        return {
+            "members": count,
+            "samples": len(matcher),
+            "dataset_s": round(dataset_s, 3),
+            "train_s": round(train_s, 3),
+            "save_s": round(save_s, 3),
+            "load_s": round(load_s, 3),
+            "predict_ms": latency_summary(timings),
+            "accuracy": round(correct / max(1, len(queries)), 4),
+            "exact_agreement": round(agree / max(1, len(queries)), 4),
+            "model_mb": round(model_bytes / 2**20, 1),
+            "rss_mb": rss,
+            "peak_rss_mb": peak
+        }
+    
+    def bench_backends(self):
+        """Compara cv.face y el reconocedor NumPy sobre el almacén del tamaño mayor"""
+        if not hasattr(cv, 'face'):
+            return None
+        targets = self.rng.integers(0, self.members[-1], BENCH_NATIVE_QUERIES)
+        queries = [synthetic_faces(int(i), 1, self.rng)[0] for i in targets]
+        results = {}
+        for name, create, path in (("opencv", cv.face.LBPHFaceRecognizer_create, 'bench_model.yml'),
+                                   ("numpy", NumpyLBPH, 'bench_model.npy')):
+            model = create()
+            started = time.perf_counter()
+            train_recognizer(model, self.workers)
+            train_s = time.perf_counter() - started
+            started = time.perf_counter()
+            model.write(path)
+            save_s = time.perf_counter() - started
+            started = time.perf_counter()
+            model = create()
+            model.read(path)
+            load_s = time.perf_counter() - started
+            started = time.perf_counter()
+            matcher = HistogramMatcher(model)
+            matcher_s = time.perf_counter() - started
+            
+            native, matched = [], []
+            for query in queries:
+                started = time.perf_counter()
+                model.predict(query)
+                native.append(time.perf_counter() - started)
+                started = time.perf_counter()
+                matcher.predict(query)
+                matched.append(time.perf_counter() - started)
+            results[name] = {
+                "train_s": round(train_s, 3),
+                "save_s": round(save_s, 3),
+                "load_s": round(load_s, 3),
+                "matcher_s": round(matcher_s, 3),
+                "file_mb": round(os.path.getsize(path) / 2**20, 1),
+                # La verificación solo usa el buscador; predict es la búsqueda exhaustiva propia
+                "predict_ms": latency_summary(native),
+                "matcher_predict_ms": latency_summary(matched)
+            }
+            del model, matcher
+            os.remove(path)
+        return results
+    
+    def bench_detection(self, video):
+        """FPS de detección sobre un video grabado (completa y con seguimiento)"""
+        capture = open_video_source(video)
+        grays = []
+        while len(grays) < self.frames:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            grays.append(cv.cvtColor(frame, cv.COLOR_BGR2GRAY))
+        capture.release()
+        if not grays:
+            return {"video": video, "frames": 0}
+        
+        result = {"video": video, "frames": len(grays),
+                  "resolution": [grays[0].shape[1], grays[0].shape[0]]}
+        for name, detect in (("full", detect_faces), ("tracked", FaceTracker().detect)):
+            timings, found = [], 0
+            for gray in grays:
+                started = time.perf_counter()
+                faces = detect(gray)
+                timings.append(time.perf_counter() - started)
+                found += len(faces) > 0
+            result[name] = {
+                "fps": round(len(grays) / max(sum(timings), 1e-9), 1),
+                "frame_ms": latency_summary(timings),
+                "frames_with_face": found
+            }
+        return result
+
+# Arranque por fases: la interfaz aparece primero y lo pesado se carga en segundo plano
+_warmup = {"phase": "Iniciando", "ready": False, "samples": False, "done": False, "error": None}
+
+def warmup_status():
+    """Copia del estado del arranque en segundo plano"""
+    return dict(_warmup)
+
+def warm_up():
+    """Carga OpenCV, el detector y el modelo, y ejecuta una detección y predicción de prueba"""
+    try:
+        _warmup["phase"] = "Cargando OpenCV"
+        blank = np.zeros((480, 640), dtype=np.uint8)
+        Image.fromarray(cv.cvtColor(blank, cv.COLOR_GRAY2RGB))
+        ImageTk.PhotoImage  # Solo el import: PhotoImage se crea en el hilo de Tk
+        
+        # La primera vez (o tras cambiar PREPROCESS_VERSION) normaliza todas las muestras
+        _warmup["phase"] = "Preparando muestras faciales"
+        prepare_samples()
+        _warmup["samples"] = True
+        
+        # Reservar los búferes de la cascada con una pasada en vacío y dejarla en el grupo
+        _warmup["phase"] = "Cargando detector facial"
+        detect_faces(blank)
+        release_face_cascade()
+        
+        _warmup["phase"] = "Cargando modelo"
+        ensure_model()
+        
+        # Predicción de prueba sin pasar por las métricas: toca el mmap y las matrices del buscador
+        _warmup["phase"] = "Preparando reconocimiento"
+        face = preprocess_face(blank[:FACE_SIZE[1], :FACE_SIZE[0]])
+        handle = current_model()
+        if handle.labels:
+            handle.predict(face)
+        _warmup.update(phase="Listo", ready=True)
+    except Exception as e:
+        _warmup.update(phase="Error al iniciar", error=str(e))
+        print(f"Error durante el arranque: {e}")
+    finally:
+        # Con o sin error el arranque terminó: la interfaz deja de esperarlo
+        _warmup["done"] = True
 
 class CameraCapture:
     """Gestiona la captura de rostros desde la cámara"""
-    def __init__(self, parent):
+    def __init__(self, parent, samples=1, voter=None):
         self.parent = parent
+        self.samples = samples
+        self.voter = voter
+        self.burst = None
+        self.detection_count = 0
+        self.shown_seq = 0
+        self.detection_seq = 0
+        self.roi = None
         self.result = None
+        self.verifying = False  # Hilo de verificación en marcha
         
     def start(self):
         """Inicia el proceso de captura"""
@@ -121,78 +3381,446 @@ class CameraCapture:
         self.capture_btn.pack(pady=2)
         
         # Iniciar cámara
-        self.cap = cv.VideoCapture(0, cv.CAP_DSHOW)
+        self.cap = open_video_source(CAMERA_SOURCE)
         if not self.cap.isOpened():
             messagebox.showerror("Error", "No se pudo acceder a la cámara")
             self.capture_window.destroy()
             return None
+        
+        # Captura y detección corren fuera del hilo de Tk
+        self.pipeline = FramePipeline(self.cap)
+        self.pipeline.start()
             
         self.update_frame()
         self.parent.wait_window(self.capture_window)
         return self.result
         
     def update_frame(self):
-        """Actualiza el fotograma de video"""
-        ret, frame = self.cap.read()
-        if ret:
-            # Espejo y procesamiento
-            frame = cv.flip(frame, 1)
-            gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
-            
-            # Guía visual para posicionar rostro
-            center_x, center_y = frame.shape[1]//2, frame.shape[0]//2
-            cv.rectangle(frame, (center_x-100, center_y-100), 
-                        (center_x+100, center_y+100), (255,255,255), 2)
-            
-            # Detección de rostros
-            faces = face_cascade.detectMultiScale(
-                gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30)
-            )
-            
-            face_detected = False
-            for (x, y, w, h) in faces:
-                cv.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
-                
-                # Verificar si el rostro está centrado
-                if (abs(x + w/2 - center_x) < 50 and 
-                    abs(y + h/2 - center_y) < 50 and
-                    len(faces) == 1):
-                    self.roi = gray[y:y+h, x:x+w]
-                    self.status.config(text="Rostro detectado. Puede capturar.")
-                    self.capture_btn.config(state="normal")
-                    face_detected = True
-                    
+        """Muestra el último fotograma listo y actualiza el estado de captura"""
+        if not self.capture_window.winfo_exists():
+            self.verifying = False
+            self.pipeline.stop()
+            return
+        
+        # El hilo de verificación ya decidió: solo queda cerrar
+        if self.verifying and self.result is not None:
+            self.close()
+            return
+        
+        # Mostrar frame en tkinter (solo si hay uno nuevo)
+        seq, img = self.pipeline.display.peek()
+        if seq != self.shown_seq:
+            self.shown_seq = seq
+            with metrics.span("photoimage"):
+                imgtk = ImageTk.PhotoImage(image=img)
+                self.video_label.imgtk = imgtk
+                self.video_label.configure(image=imgtk)
+        
+        seq, detection = self.pipeline.detections.peek()
+        if seq != self.detection_seq:
+            self.detection_seq = seq
+            if self.on_detection(detection):
+                return
+        
+        self.capture_window.after(10, self.update_frame)
+    
+    def on_detection(self, detection):
+        """Procesa un nuevo resultado de detección; devuelve True si la captura terminó"""
+        face_detected = detection["roi"] is not None
+        if face_detected:
+            self.roi = detection["roi"]
+        
+        self.detection_count += 1
+        if self.burst is not None and self.voter is not None:
+            # Verificación: el hilo de reconocimiento vota; aquí solo se muestra el avance
             if not face_detected:
-                self.status.config(text="Centre su rostro en el recuadro")
-                self.capture_btn.config(state="disabled")
-                
-            # Mostrar frame en tkinter
-            img = cv.cvtColor(frame, cv.COLOR_BGR2RGB)
-            img = Image.fromarray(img)
-            imgtk = ImageTk.PhotoImage(image=img)
-            self.video_label.imgtk = imgtk
-            self.video_label.configure(image=imgtk)
-            
-        # Continuar si la ventana sigue abierta
-        if self.capture_window.winfo_exists():
-            self.capture_window.after(10, self.update_frame)
+                text = "Mantenga el rostro en el recuadro"
+            elif self.voter.pending is not None:
+                text = "Comprobando prueba de vida... mire a la cámara y parpadee"
+            else:
+                text = "Verificando..."
+            self.status.config(text=text)
+        elif self.burst is not None:
+            # Ráfaga en curso: tomar una muestra cada BURST_INTERVAL detecciones
+            if face_detected and self.detection_count % BURST_INTERVAL == 0:
+                self.burst.append(self.roi)
+                if len(self.burst) >= self.samples:
+                    self.result = self.burst
+                    self.close()
+                    return True
+            self.status.config(
+                text=f"Capturando muestras {len(self.burst)}/{self.samples}..."
+                if face_detected else "Mantenga el rostro en el recuadro"
+            )
+        elif face_detected:
+            self.status.config(text="Rostro detectado. Puede capturar.")
+            self.capture_btn.config(state="normal")
         else:
-            self.cap.release()
+            self.status.config(text="Centre su rostro en el recuadro")
+            self.capture_btn.config(state="disabled")
+        return False
             
     def on_capture(self):
         """Procesa captura de rostro"""
-        self.result = self.roi
+        if self.voter is not None:
+            # Las siguientes detecciones se envían al votador
+            self.burst = []
+            self.voter.reset()
+            self.capture_btn.config(state="disabled")
+            self.verifying = True
+            threading.Thread(target=self._verify_loop, daemon=True).start()
+            return
+        if self.samples <= 1:
+            self.result = self.roi
+            self.close()
+            return
+        # Capturar varias muestras en una ráfaga corta
+        self.burst = [self.roi]
+        self.capture_btn.config(state="disabled")
+    
+    def _verify_loop(self):
+        """Predice y vota con cada detección fuera del hilo de Tk hasta que haya una decisión"""
+        seq = self.detection_seq
+        while self.verifying and self.result is None:
+            new_seq, detection = self.pipeline.detections.get(seq, timeout=0.1)
+            if new_seq == seq:
+                continue
+            seq = new_seq
+            if detection["roi"] is None:
+                continue
+            try:
+                self.voter.observe(detection["gray"], detection["box"])
+                # Con una decisión retenida por la prueba de vida no hace falta predecir más
+                if self.voter.pending is not None:
+                    result = self.voter.poll()
+                else:
+                    result = self.voter.add(*predict_face(detection["roi"]))
+            except Exception as e:
+                print(f"Error durante la verificación: {e}")
+                continue
+            if result is not None:
+                self.result = result
+    
+    def close(self):
+        """Cierra la ventana y libera la cámara"""
+        self.verifying = False
         self.capture_window.destroy()
-        self.cap.release()
+        self.pipeline.stop()
+
+class KioskMode:
+    """Modo kiosko: cámara y modelo siempre abiertos con reconocimiento automático"""
+    def __init__(self, app):
+        self.app = app
+        self.parent = app.root
+        self.decisions = LatestFrame()
+        self.repeats = RepeatFilter()
+        self.shown_seq = 0
+        self.decision_seq = 0
+        self.hide_job = None
+        self.running = False
+        self.thread = None
+    
+    def start(self):
+        """Abre la ventana del kiosko y comienza el reconocimiento continuo"""
+        if self.app.model_busy():
+            return
+        if not ensure_model(block=False):
+            messagebox.showerror("Error", "No hay miembros registrados")
+            return
+        
+        self.window = tk.Toplevel(self.parent)
+        self.window.title("Modo Kiosko")
+        self.window.configure(bg=DARK_BG)
+        self.window.geometry("680x600")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        self.window.bind("<Escape>", lambda event: self.close())
+        
+        # Marco para el video con el resultado superpuesto
+        frame = tk.Frame(self.window, bg=LIGHT_BG, bd=2, relief=tk.GROOVE)
+        frame.pack(pady=10, padx=10, fill=tk.BOTH, expand=True)
+        
+        self.video_label = tk.Label(frame, bg=LIGHT_BG)
+        self.video_label.pack(fill=tk.BOTH, expand=True)
+        
+        self.banner = tk.Label(
+            frame,
+            bg=DARK_BG,
+            fg=TEXT_COLOR,
+            font=("Arial", 18, "bold"),
+            pady=10
+        )
+        
+        self.status = tk.Label(
+            self.window,
+            text="Mire a la cámara para ingresar",
+            bg=DARK_BG,
+            fg=TEXT_COLOR,
+            font=("Arial", 11)
+        )
+        self.status.pack(pady=2)
+        
+        ttk.Button(self.window, text="Salir", command=self.close, width=15).pack(pady=(2, 10))
+        
+        # Iniciar cámara
+        self.cap = open_video_source(CAMERA_SOURCE)
+        if not self.cap.isOpened():
+            messagebox.showerror("Error", "No se pudo acceder a la cámara")
+            self.window.destroy()
+            return
+        
+        self.pipeline = FramePipeline(self.cap)
+        self.pipeline.start()
+        self.running = True
+        self.thread = threading.Thread(target=self._recognize_loop, daemon=True)
+        self.thread.start()
+        self.update_frame()
+    
+    def _recognize_loop(self):
+        """Reconoce automáticamente cuando hay un único rostro centrado y estable"""
+        voter = RecognitionVoter()
+        seq = 0
+        stable = 0
+        decided = False
+        while self.running:
+            new_seq, detection = self.pipeline.detections.get(seq, timeout=0.1)
+            if new_seq == seq:
+                continue
+            seq = new_seq
+            if detection["roi"] is None:
+                # La persona se fue: preparar la siguiente decisión
+                stable = 0
+                decided = False
+                voter.reset()
+                continue
+            voter.observe(detection["gray"], detection["box"])
+            stable += 1
+            if stable < KIOSK_STABLE_FRAMES or decided:
+                continue
+            
+            try:
+                if voter.pending is not None:
+                    prediction = voter.poll()
+                else:
+                    prediction = voter.add(*predict_face(detection["roi"]))
+                if prediction is None:
+                    continue
+                # Se registra al mostrarse, tras descartar repeticiones
+                decision = engine.decide(*prediction, latency_ms=voter.latency * 1000, log=False)
+                voter.reset()
+            except Exception as e:
+                print(f"Error durante la verificación: {e}")
+                continue
+            # Con una decisión firme no se procesan más fotogramas de esta persona
+            decided = decision["status"] != "unrecognized"
+            
+            if self.repeats.accept(decision):
+                self.decisions.put(decision)
+    
+    def update_frame(self):
+        """Muestra el último fotograma y el último resultado de reconocimiento"""
+        if not self.running:
+            return
+        
+        seq, img = self.pipeline.display.peek()
+        if seq != self.shown_seq:
+            self.shown_seq = seq
+            with metrics.span("photoimage"):
+                imgtk = ImageTk.PhotoImage(image=img)
+                self.video_label.imgtk = imgtk
+                self.video_label.configure(image=imgtk)
+        
+        seq, decision = self.decisions.peek()
+        if seq != self.decision_seq:
+            self.decision_seq = seq
+            self.show_decision(decision)
+        
+        self.window.after(10, self.update_frame)
+    
+    def show_decision(self, decision):
+        """Superpone el resultado sobre el video durante unos segundos"""
+        status = decision["status"]
+        if status == "granted":
+            text, color = f"✓ Bienvenido, {decision['name']}", "#4CAF50"
+            if decision["days_left"] <= EXPIRING_DAYS:
+                text += f"\n⚠️ Su membresía vence en {decision['days_left']} días"
+            self.app.status_text.set(f"Acceso autorizado: {decision['name']}")
+        elif status == "expired":
+            text, color = f"✕ {decision['name']}: membresía vencida", "#F44336"
+            self.app.status_text.set(f"Acceso denegado: {decision['name']} - Membresía vencida")
+        elif status == "not_found":
+            text, color = "✕ Miembro no encontrado", "#F44336"
+        elif status == "spoof":
+            text, color = "✕ Prueba de vida no superada", "#F44336"
+        else:
+            text, color = "Rostro no reconocido, inténtelo de nuevo", "#FFC107"
+        
+        self.app.log_access(decision)
+        self.banner.config(text=text, bg=color)
+        self.banner.place(relx=0, rely=0, relwidth=1)
+        if self.hide_job is not None:
+            self.window.after_cancel(self.hide_job)
+        self.hide_job = self.window.after(KIOSK_RESULT_SECONDS * 1000, self.banner.place_forget)
+    
+    def close(self):
+        """Detiene el reconocimiento, libera la cámara y cierra la ventana"""
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+        self.pipeline.stop()
+        self.window.destroy()
+
+class MemberBrowser:
+    """Buscador de miembros: filtra mientras se escribe y carga la lista página a página"""
+    def __init__(self, parent, on_select):
+        self.on_select = on_select
+        self.query = tk.StringVar()
+        self.rows = []  # (membership_id, nombre, fecha) cargados en la lista
+        self.exhausted = False
+        self.search_job = None
+        
+        self.entry = tk.Entry(parent, textvariable=self.query, width=36)
+        self.entry.pack(pady=(5, 0), anchor="center")
+        self.entry.bind("<Return>", self.lookup)
+        
+        list_frame = tk.Frame(parent, bg=DARK_BG)
+        list_frame.pack(pady=5, anchor="center")
+        self.scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL)
+        self.listbox = tk.Listbox(
+            list_frame,
+            height=6,
+            width=38,
+            bg=LIGHT_BG,
+            fg=TEXT_COLOR,
+            selectbackground=ACCENT_COLOR,
+            exportselection=False,
+            yscrollcommand=self._scrolled
+        )
+        self.scrollbar.config(command=self.listbox.yview)
+        self.listbox.pack(side=tk.LEFT)
+        self.scrollbar.pack(side=tk.LEFT, fill=tk.Y)
+        self.listbox.bind("<<ListboxSelect>>", self._selected)
+        
+        self.query.trace_add("write", self._schedule_search)
+        self.search()
+    
+    def _schedule_search(self, *args):
+        """Agrupa las pulsaciones seguidas en una sola búsqueda"""
+        if self.search_job is not None:
+            self.entry.after_cancel(self.search_job)
+        self.search_job = self.entry.after(MEMBER_SEARCH_DELAY, self.search)
+    
+    def search(self):
+        """Vacía la lista y carga la primera página de resultados"""
+        self.search_job = None
+        self.rows = []
+        self.exhausted = False
+        self.listbox.delete(0, tk.END)
+        self.load_page()
+    
+    def load_page(self):
+        """Añade la siguiente página, continuando tras la última fila cargada"""
+        if self.exhausted:
+            return
+        after = (self.rows[-1][1], self.rows[-1][0]) if self.rows else None
+        page = member_repo.search(self.query.get().strip(), after)
+        self.exhausted = len(page) < MEMBER_PAGE_SIZE
+        self.rows.extend(page)
+        if page:
+            self.listbox.insert(tk.END, *[f"{name} ({member_id})" for member_id, name, _ in page])
+    
+    def _scrolled(self, first, last):
+        """Actualiza la barra y pide otra página al acercarse al final de la lista"""
+        self.scrollbar.set(first, last)
+        if float(last) > 0.9:
+            self.load_page()
+    
+    def _selected(self, event):
+        """Avisa del miembro elegido en la lista"""
+        selection = self.listbox.curselection()
+        if selection:
+            self.on_select(self.rows[selection[0]][0])
+    
+    def lookup(self, event=None):
+        """Con Enter, un ID exacto abre directamente ese miembro"""
+        member_id = self.query.get().strip()
+        if member_repo.get(member_id) is not None:
+            self.on_select(member_id)
+        elif len(self.rows) == 1:
+            self.on_select(self.rows[0][0])
 
 class GymAccessApp:
     """Aplicación principal de control de acceso"""
     def __init__(self, root):
         self.root = root
         self.root.title("GymAccess - Control de Acceso")
-        self.root.geometry("700x500")
+        self.root.geometry("700x550")
         self.root.configure(bg=DARK_BG)
         self.setup_ui()
+        self.training_shown = False
+        self.ready_shown = False
+        self.poll_training()
+    
+    def poll_training(self):
+        """Refleja en la barra de estado el arranque y el avance de un entrenamiento en segundo plano"""
+        progress = training_progress()
+        status = warmup_status()
+        if status["error"] and not self.ready_shown:
+            self.status_text.set(f"{status['phase']}: {status['error']}")
+            self.ready_shown = True
+            messagebox.showerror("Error al iniciar", f"{status['error']}\n\n"
+                                 "Las acciones volverán a intentarlo al usarse.", parent=self.root)
+        elif progress["active"] and progress["total"]:
+            percent = 100 * progress["done"] // progress["total"]
+            self.status_text.set(
+                f"Entrenando modelo: {progress['done']}/{progress['total']} muestras ({percent}%)"
+            )
+            self.training_shown = True
+        elif self.training_shown:
+            self.status_text.set("Modelo actualizado")
+            self.training_shown = False
+        elif not self.ready_shown:
+            if status["ready"]:
+                self.status_text.set(f"Sistema listo ({len(current_model().labels)} miembros)")
+                self.ready_shown = True
+            else:
+                self.status_text.set(f"{status['phase']}...")
+        self.root.after(500, self.poll_training)
+    
+    def samples_busy(self):
+        """Avisa si el almacén de muestras todavía se está preparando en el arranque"""
+        status = warmup_status()
+        if status["samples"]:
+            return False
+        if not status["done"]:
+            messagebox.showinfo("Muestras", "Las muestras faciales se están preparando. "
+                                "Inténtelo en unos momentos.", parent=self.root)
+            return True
+        # El arranque falló antes de prepararlas: reintentar aquí y mostrar el error si persiste
+        try:
+            prepare_samples()
+        except Exception as e:
+            messagebox.showerror("Muestras", f"No se pudieron preparar las muestras faciales:\n{e}",
+                                 parent=self.root)
+            return True
+        _warmup["samples"] = True
+        return False
+    
+    def model_busy(self):
+        """Avisa si todavía no se publicó ninguna versión del modelo"""
+        # Un reentrenamiento posterior no bloquea: se sigue verificando con la versión vigente
+        if current_model().version:
+            return False
+        if warmup_status()["done"]:
+            # El arranque terminó sin modelo (falló): reintentar y mostrar el error si persiste
+            try:
+                ensure_model(block=False)
+            except Exception as e:
+                messagebox.showerror("Modelo", f"No se pudo cargar el modelo:\n{e}", parent=self.root)
+                return True
+            return False
+        messagebox.showinfo("Modelo", "El modelo se está cargando. Inténtelo en unos momentos.",
+                            parent=self.root)
+        return True
         
     def setup_ui(self):
         """Configura la interfaz de usuario"""
@@ -288,7 +3916,13 @@ class GymAccessApp:
             verify_frame,
             text="Verificar Acceso",
             command=self.verify_member
-        ).pack(pady=10)
+        ).pack(pady=(10, 4))
+        
+        ttk.Button(
+            verify_frame,
+            text="Modo Kiosko",
+            command=lambda: KioskMode(self).start()
+        ).pack(pady=(0, 10))
         
         # Tarjeta de edición
         edit_frame = tk.Frame(main_frame, bg=LIGHT_BG, padx=15, pady=15, bd=1, relief=tk.SOLID)
@@ -323,14 +3957,20 @@ class GymAccessApp:
             text="Editar Miembro",
             command=self.edit_member,
             style="Accent.TButton"
-        ).pack(pady=10)
+        ).pack(pady=(10, 4))
+        
+        ttk.Button(
+            edit_frame,
+            text="Próximos Vencimientos",
+            command=self.show_expiring
+        ).pack(pady=(0, 10))
         
         # Barra de estado
         status_bar = tk.Frame(self.root, bg=LIGHT_BG, height=25)
         status_bar.pack(fill=tk.X, side=tk.BOTTOM)
         
         self.status_text = tk.StringVar()
-        self.status_text.set("Sistema listo")
+        self.status_text.set("Iniciando...")
         
         tk.Label(
             status_bar,
@@ -342,6 +3982,8 @@ class GymAccessApp:
         
     def register_member(self):
         """Gestiona el registro de un nuevo miembro"""
+        if self.samples_busy():
+            return
         # Pedir datos
         dialog = tk.Toplevel(self.root)
         dialog.title("Registrar Miembro")
@@ -413,28 +4055,23 @@ class GymAccessApp:
             return
             
         # Capturar rostro
-        camera = CameraCapture(self.root)
-        roi = camera.start()
+        camera = CameraCapture(self.root, samples=SAMPLES_PER_MEMBER)
+        faces = camera.start()
         
-        if roi is None:
+        if faces is None:
             messagebox.showerror("Error", "No se pudo capturar el rostro")
             return
             
         # Guardar en BD y archivo
         try:
-            # Guardar imagen
-            img_path = os.path.join(SAMPLES_DIR, f"{result['id']}.png")
-            cv.imwrite(img_path, roi)
+            # Guardar muestras
+            faces = save_member_samples(result["id"], faces)
             
             # Guardar en BD
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute(
-                'INSERT INTO members VALUES (?, ?, ?)',
-                (result["id"], result["name"], result["date"])
-            )
-            conn.commit()
-            conn.close()
+            member_repo.add(result["id"], result["name"], result["date"])
+            
+            # Añadir al modelo sin reentrenar
+            add_face_samples(result["id"], faces)
             
             messagebox.showinfo("Éxito", f"Miembro {result['name']} registrado correctamente")
             self.status_text.set(f"Miembro registrado: {result['name']}")
@@ -446,56 +4083,54 @@ class GymAccessApp:
     
     def verify_member(self):
         """Verifica el acceso de un miembro"""
-        # Entrenar reconocedor
-        member_ids = train_recognizer()
-        if not member_ids:
+        if self.model_busy():
+            return
+        
+        # Versión vigente del modelo (si las muestras cambiaron se reentrena en segundo plano)
+        member_labels = ensure_model(block=False)
+        if not member_labels:
             messagebox.showerror("Error", "No hay miembros registrados")
             return
             
-        # Capturar rostro
-        camera = CameraCapture(self.root)
-        roi = camera.start()
+        # Capturar rostro y votar sobre varios fotogramas
+        camera = CameraCapture(self.root, voter=RecognitionVoter())
+        prediction = camera.start()
         
-        if roi is None:
+        if prediction is None:
             return
             
         try:
             # Reconocimiento
-            label, confidence = recognizer.predict(roi)
-            # Verificar umbral de confianza (valores más bajos indican mejor coincidencia en LBPH)
-            CONFIDENCE_THRESHOLD = 70  # Ajusta este valor según tus necesidades (50-80 es común)
-            if confidence > CONFIDENCE_THRESHOLD:
+            decision = engine.decide(*prediction, latency_ms=camera.voter.latency * 1000)
+            if decision["status"] == "spoof":
+                messagebox.showwarning("Verificación",
+                                    "No se superó la prueba de vida.\n"
+                                    "Retire fotos o pantallas, mire a la cámara e inténtelo de nuevo.",
+                                    parent=self.root)
+                return
+            
+            if decision["status"] == "unrecognized":
                 messagebox.showwarning("Verificación", 
                                     "No se pudo verificar su identidad con suficiente confianza.\n"
                                     "Por favor, inténtelo de nuevo o contacte al personal.",
                                     parent=self.root)
                 return
-
-
-            membership_id = member_ids[label]
             
-            # Buscar en BD
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute('SELECT name, expiration_date FROM members WHERE membership_id = ?', 
-                     (membership_id,))
-            row = c.fetchone()
-            conn.close()
-            
-            if not row:
+            if decision["status"] == "not_found":
                 messagebox.showerror("Error", "Miembro no encontrado en la base de datos")
                 return
                 
-            name, exp_str = row
-            exp_date = datetime.strptime(exp_str, "%Y-%m-%d").date()
-            today = datetime.today().date()
+            membership_id = decision["membership_id"]
+            name = decision["name"]
+            exp_date = decision["exp_date"]
+            days_left = decision["days_left"]
             
             # Resultado
             result = tk.Toplevel(self.root)
             result.geometry("400x350")
             result.configure(bg=DARK_BG)
             
-            if exp_date >= today:
+            if decision["status"] == "granted":
                 # Acceso permitido
                 result.title("Acceso Autorizado")
                 
@@ -527,8 +4162,7 @@ class GymAccessApp:
                     justify=tk.LEFT
                 ).pack(anchor="w")
                 
-                days_left = (exp_date - today).days
-                if days_left <= 7:
+                if days_left <= EXPIRING_DAYS:
                     tk.Label(
                         info_frame,
                         text=f"⚠️ Su membresía vence en {days_left} días",
@@ -538,7 +4172,6 @@ class GymAccessApp:
                     ).pack(anchor="w", pady=(10, 0))
                 
                 self.status_text.set(f"Acceso autorizado: {name}")
-                self.log_access(name)
                 
             else:
                 # Acceso denegado
@@ -592,44 +4225,20 @@ class GymAccessApp:
         except Exception as e:
             messagebox.showerror("Error", f"Error durante la verificación: {str(e)}")
             
-    def log_access(self, name):
-        """Registra el acceso en el archivo CSV"""
-        filename = 'acceso_gimnasio.csv'
-        now = datetime.now()
-        
-        # Verificar si el archivo existe para escribir encabezados
-        file_exists = os.path.isfile(filename)
-        
-        with open(filename, 'a', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            
-            # Escribir encabezado si el archivo está vacío o no existe
-            if not file_exists or file.tell() == 0:
-                writer.writerow(["Fecha", "Hora", "Nombre"])
-            
-            # Escribir datos del acceso
-            writer.writerow([
-                now.strftime("%Y-%m-%d"),
-                now.strftime("%H:%M:%S"),
-                name
-            ])
+    def log_access(self, decision):
+        """Registra el intento de acceso (autorizado o denegado) sin bloquear la UI"""
+        access_log.record(decision)
+    
     def edit_member(self):
         """Edita los datos de un miembro registrado"""
-        # Obtener lista de miembros
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute('SELECT membership_id, name, expiration_date FROM members')
-        members = c.fetchall()
-        conn.close()
-        
-        if not members:
+        if not member_repo.count():
             messagebox.showinfo("Información", "No hay miembros registrados para editar")
             return
 
         # Crear ventana de edición
         edit_window = tk.Toplevel(self.root)
         edit_window.title("Editar Miembro")
-        edit_window.geometry("400x400")
+        edit_window.geometry("400x520")
         edit_window.configure(bg=DARK_BG)
         
         # Contenedor principal
@@ -637,24 +4246,24 @@ class GymAccessApp:
         main_frame.pack(pady=15, padx=20, fill=tk.BOTH, expand=True)
         
         tk.Label(main_frame, text="Editar Miembro", bg=DARK_BG, fg=TEXT_COLOR,font=("Arial", 12, "bold")).pack(pady=10) 
-        # Selección de miembro
-        tk.Label(main_frame, text="Seleccionar Miembro:", bg=DARK_BG, fg=TEXT_COLOR).pack(anchor="center")
-        
-        self.selected_member = tk.StringVar()
-        member_names = [f"{name} ({id})" for id, name, _ in members]
-        member_dropdown = ttk.Combobox(
-            main_frame,
-            textvariable=self.selected_member,
-            values=member_names,
-            state="readonly",
-            width=30,
-            font=("Arial", 10)
-        )
-        member_dropdown.pack(pady=10, anchor="center")
+        # Selección de miembro: búsqueda por nombre o ID
+        tk.Label(main_frame, text="Buscar Miembro (nombre o ID):", bg=DARK_BG, fg=TEXT_COLOR).pack(anchor="center")
+        
+        # Cargar datos al seleccionar miembro (búsqueda directa por clave en la caché)
+        def load_member_data(member_id):
+            record = member_repo.get(member_id)
+            if record is not None:
+                name, exp_date = record
+                self.edit_id.set(member_id)
+                self.edit_name.set(name)
+                self.edit_date.set(exp_date.strftime("%Y-%m-%d"))
+        
+        browser = MemberBrowser(main_frame, load_member_data)
+        browser.entry.focus_set()
         
         # Formulario de edición
         form_frame = tk.Frame(main_frame, bg=DARK_BG)
-        form_frame.pack(pady=15, anchor="center")
+        form_frame.pack(pady=5, anchor="center")
         
         # Campos editables
         tk.Label(form_frame, text="Nombre:", bg=DARK_BG, fg=TEXT_COLOR).grid(row=0, column=0, sticky="e", pady=5)
@@ -698,30 +4307,46 @@ class GymAccessApp:
             width=8.5
         ).pack(side=tk.LEFT, padx=8)
 
-
-        # Cargar datos al seleccionar miembro
-        def load_member_data(event):
-            selected = self.selected_member.get()
-            if selected:
-                member_id = selected.split("(")[-1].strip(")")
-                for m in members:
-                    if m[0] == member_id:
-                        self.edit_id.set(m[0])
-                        self.edit_name.set(m[1])
-                        self.edit_date.set(m[2])
-                        break
-
-        member_dropdown.bind("<<ComboboxSelected>>", load_member_data)
-
+    def show_expiring(self):
+        """Lista los miembros cuya membresía vence en los próximos EXPIRING_DAYS días"""
+        members = member_repo.expiring(EXPIRING_DAYS)
+        
+        window = tk.Toplevel(self.root)
+        window.title("Próximos Vencimientos")
+        window.geometry("420x320")
+        window.configure(bg=DARK_BG)
+        
+        tk.Label(
+            window,
+            text=f"Vencen en los próximos {EXPIRING_DAYS} días: {len(members)}",
+            bg=DARK_BG,
+            fg=TEXT_COLOR,
+            font=("Arial", 11, "bold")
+        ).pack(pady=10)
+        
+        list_frame = tk.Frame(window, bg=DARK_BG)
+        list_frame.pack(padx=15, fill=tk.BOTH, expand=True)
+        scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL)
+        listbox = tk.Listbox(list_frame, bg=LIGHT_BG, fg=TEXT_COLOR, yscrollcommand=scrollbar.set)
+        scrollbar.config(command=listbox.yview)
+        listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.LEFT, fill=tk.Y)
+        if members:
+            listbox.insert(tk.END, *[f"{exp_date.strftime('%d/%m/%Y')}  {name} ({member_id})"
+                                     for member_id, name, exp_date in members])
+        
+        ttk.Button(window, text="Cerrar", command=window.destroy).pack(pady=10)
+    
     def update_face(self, member_id):
         """Actualiza la muestra facial de un miembro"""
-        camera = CameraCapture(self.root)
-        roi = camera.start()
+        if self.samples_busy():
+            return
+        camera = CameraCapture(self.root, samples=SAMPLES_PER_MEMBER)
+        faces = camera.start()
         
-        if roi is not None:
-            img_path = os.path.join(SAMPLES_DIR, f"{member_id}.png")
-            cv.imwrite(img_path, roi)
-            train_recognizer()
+        if faces is not None:
+            faces = save_member_samples(member_id, faces)
+            add_face_samples(member_id, faces, replaced=True)
             messagebox.showinfo("Éxito", "Muestra facial actualizada correctamente")
 
     def save_edits(self, window):
@@ -742,19 +4367,10 @@ class GymAccessApp:
             return
 
         try:
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute('''
-                UPDATE members 
-                SET name = ?, expiration_date = ?
-                WHERE membership_id = ?
-            ''', (new_name, new_date, member_id))
-            conn.commit()
-            conn.close()
+            member_repo.update(member_id, new_name, new_date)
             
             messagebox.showinfo("Éxito", "Datos actualizados correctamente")
             window.destroy()
-            train_recognizer()  # Reentrenar modelo con posibles nuevas imágenes
             
         except Exception as e:
             messagebox.showerror("Error", f"Error al actualizar: {str(e)}")
@@ -762,12 +4378,209 @@ class GymAccessApp:
 
 def main():
     """Función principal"""
+    parser = argparse.ArgumentParser(description="GymAccess - Control de Acceso")
+    parser.add_argument("--metrics", action="store_true",
+                        help=f"Cronometrar cada etapa (GET /metrics en serve; {METRICS_DUMP_PATH} en la interfaz)")
+    parser.add_argument("--overlay", action="store_true",
+                        help="Mostrar FPS y latencias sobre el video de las ventanas de captura")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser(
+        "migrate-samples",
+        help="Crea el almacén de muestras desde face_samples/ o lo migra al formato actual"
+    )
+    import_parser = subparsers.add_parser(
+        "import-samples",
+        help="Añade al almacén las muestras de un directorio con el formato de face_samples/"
+    )
+    import_parser.add_argument("directory", nargs="?", default=SAMPLES_DIR)
+    export_parser = subparsers.add_parser(
+        "export-samples",
+        help="Escribe el almacén como un .npy por miembro en un directorio"
+    )
+    export_parser.add_argument("directory", nargs="?", default=SAMPLES_DIR)
+    members_parser = subparsers.add_parser(
+        "import-members",
+        help="Alta masiva desde un CSV (membership_id,name,expiration_date[,photo]) y una carpeta de fotos"
+    )
+    members_parser.add_argument("csv", help="Archivo CSV de miembros")
+    members_parser.add_argument("--photos", metavar="CARPETA",
+                                help="Fotos ID.jpg o subcarpetas ID/ con varias fotos por miembro")
+    members_parser.add_argument("--workers", type=int, default=TRAIN_WORKERS,
+                                help="Procesos de detección y entrenamiento (por defecto, uno por núcleo)")
+    archive_parser = subparsers.add_parser(
+        "export-archive",
+        help="Empaqueta miembros, muestras y modelo en un .zip para llevarlos a otro equipo"
+    )
+    archive_parser.add_argument("archive", nargs="?",
+                                default=f"gymaccess-{date.today():%Y%m%d}.zip")
+    restore_parser = subparsers.add_parser(
+        "import-archive",
+        help="Restaura en una instalación vacía un .zip creado con export-archive"
+    )
+    restore_parser.add_argument("archive")
+    bench_parser = subparsers.add_parser(
+        "bench",
+        help="Banco de pruebas con datos sintéticos (no toca la BD ni el modelo reales)"
+    )
+    bench_parser.add_argument("--members", default=",".join(map(str, BENCH_MEMBERS)),
+                              help="Tamaños de la base separados por comas (p. ej. 100,1000,50000)")
+    bench_parser.add_argument("--samples", type=int, default=SAMPLES_PER_MEMBER,
+                              help="Muestras por miembro")
+    bench_parser.add_argument("--queries", type=int, default=BENCH_QUERIES,
+                              help="Predicciones medidas por tamaño")
+    bench_parser.add_argument("--video", help="Video grabado para medir la detección")
+    bench_parser.add_argument("--frames", type=int, default=BENCH_FRAMES,
+                              help="Fotogramas del video a medir")
+    bench_parser.add_argument("--workers", type=int, default=TRAIN_WORKERS,
+                              help="Procesos de entrenamiento (por defecto, uno por núcleo)")
+    bench_parser.add_argument("--seed", type=int, default=0)
+    bench_parser.add_argument("--output", help="Archivo JSON de resultados (por defecto, la salida estándar)")
+    bench_parser.add_argument("--workdir", help="Conservar los datos sintéticos en este directorio")
+    expiring_parser = subparsers.add_parser(
+        "expiring",
+        help="Lista los miembros cuya membresía vence pronto"
+    )
+    expiring_parser.add_argument("--days", type=int, default=EXPIRING_DAYS,
+                                 help="Días hacia adelante")
+    expiring_parser.add_argument("--expired", type=int, default=0, metavar="DÍAS",
+                                 help="Incluir también los vencidos en los últimos DÍAS días")
+    rebuild_parser = subparsers.add_parser(
+        "rebuild",
+        help="Reentrena el modelo completo sin abrir la interfaz (p. ej. cada noche)"
+    )
+    rebuild_parser.add_argument("--workers", type=int, default=TRAIN_WORKERS,
+                                help="Procesos de entrenamiento (por defecto, uno por núcleo)")
+    serve_parser = subparsers.add_parser(
+        "serve",
+        help="Servicio de verificación sin interfaz para varios terminales"
+    )
+    serve_parser.add_argument("--host", default=SERVER_HOST)
+    serve_parser.add_argument("--port", type=int, default=SERVER_PORT)
+    serve_parser.add_argument("--unix", metavar="RUTA",
+                              help="Escuchar en un socket Unix en lugar de TCP")
+    multicam_parser = subparsers.add_parser(
+        "multicam",
+        help="Verificación continua en varias entradas con un grupo de procesos compartido"
+    )
+    multicam_parser.add_argument("sources", nargs="+", metavar="FUENTE",
+                                 help="Índice de cámara, archivo de video, URL o carpeta de imágenes")
+    multicam_parser.add_argument("--workers", type=int, default=None,
+                                 help="Procesos de reconocimiento (por defecto, uno por núcleo)")
+    multicam_parser.add_argument("--duration", type=float, default=None,
+                                 help="Segundos de ejecución (por defecto, hasta agotar las fuentes)")
+    multicam_parser.add_argument("--fast", action="store_true",
+                                 help="Leer archivos grabados lo más rápido posible")
+    multicam_parser.add_argument("--json", action="store_true",
+                                 help="Imprimir las métricas finales en JSON")
+    args = parser.parse_args()
+    if args.metrics or args.overlay:
+        metrics.enabled = True
+        metrics.overlay = metrics.overlay or args.overlay
+    
+    if args.command == "bench":
+        benchmark = Benchmark(
+            [int(count) for count in args.members.split(",") if count.strip()],
+            args.samples, args.queries, args.video, args.frames, args.workers, args.seed
+        )
+        results = json.dumps(benchmark.run(args.workdir), indent=2)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as file:
+                file.write(results + "\n")
+        else:
+            print(results)
+        return
+    
     # Inicializar DB y directorios
     init_db()
     
-    # Crear interfaz
+    if args.command == "migrate-samples":
+        migrated = prepare_samples()
+        print(f"Miembros migrados: {migrated}")
+        return
+    
+    if args.command == "expiring":
+        for member_id, name, exp_date in member_repo.expiring(args.days, args.expired):
+            print(f"{exp_date.isoformat()}  {member_id}  {name}")
+        return
+    
+    # Crear el almacén de muestras (o migrarlo) antes de usarlo; la interfaz lo hace en warm_up
+    if args.command is not None:
+        prepare_samples()
+    
+    if args.command == "import-samples":
+        imported = sample_store.import_dir(args.directory)
+        print(f"Miembros importados: {imported}")
+        return
+    
+    if args.command == "export-samples":
+        exported = sample_store.export_dir(args.directory)
+        print(f"Miembros exportados: {exported}")
+        return
+    
+    if args.command == "import-members":
+        report = import_members(
+            args.csv, args.photos, args.workers,
+            progress=lambda stage, done, total: print(f"\rProcesando {stage}: {done}/{total}",
+                                                      end="", flush=True)
+        )
+        print()
+        for line, error in report["errors"]:
+            print(f"Línea {line} omitida: {error}")
+        for member_id, problem in report["problems"]:
+            print(f"{member_id}: {problem}")
+        print(f"Miembros importados: {report['members']}, con rostro: {report['with_faces']}, "
+              f"sin rostro: {len(report['without_face'])}, en el modelo: {report['trained']}")
+        return
+    
+    if args.command == "export-archive":
+        manifest = export_archive(args.archive)
+        print(f"Archivo creado: {args.archive} ({manifest['members']} miembros)")
+        return
+    
+    if args.command == "import-archive":
+        try:
+            manifest = import_archive(args.archive)
+        except (RuntimeError, ValueError) as e:
+            print(f"Error: {e}")
+            return
+        print(f"Restaurados {manifest['members']} miembros de {args.archive}")
+        return
+    
+    if args.command == "rebuild":
+        started = time.perf_counter()
+        labels = rebuild_model(
+            args.workers,
+            progress=lambda done, total: print(f"\rEntrenando: {done}/{total} muestras",
+                                               end="", flush=True)
+        )
+        print(f"\nModelo reentrenado: {len(labels)} miembros en "
+              f"{time.perf_counter() - started:.1f} s")
+        return
+    
+    if args.command == "serve":
+        # Cargar modelo persistido (o entrenarlo si las muestras cambiaron) y calentar la ruta
+        warm_up()
+        VerificationServer(engine, args.host, args.port, args.unix).run()
+        access_log.close()
+        return
+    
+    if args.command == "multicam":
+        ensure_model()
+        monitor = MultiCameraMonitor(args.sources, args.workers, realtime=not args.fast)
+        stats = monitor.run(args.duration)
+        access_log.close()
+        if args.json:
+            print(json.dumps(stats, indent=2))
+        return
+    
+    # Sin servidor HTTP, las métricas se vuelcan periódicamente a un archivo JSON
+    if metrics.enabled:
+        metrics.start_dump()
+    
+    # Crear interfaz; OpenCV, el detector y el modelo se cargan en segundo plano sin bloquearla
     root = tk.Tk()
     app = GymAccessApp(root)
+    threading.Thread(target=warm_up, daemon=True).start()
     
     # Centrar ventana
     root.update_idletasks()
@@ -778,6 +4591,11 @@ def main():
     root.geometry(f'+{x}+{y}')
     
     root.mainloop()
+    
+    # Escribir los accesos pendientes (y las últimas métricas) antes de salir
+    access_log.close()
+    if metrics.enabled:
+        metrics.dump()
 
 
 if __name__ == '__main__':